@@ -1,23 +1,33 @@
 from utils.model import ExecutionResult, Task, Response
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional, Set
+import asyncio
+import contextvars
+import json
 import logging
+import threading
+import time
 import ast
-import traceback
 import ollama
 
 from reflection import Reflection
-
-
-class TaskExecutor:
-    def __init__(self):
-        self.logger = logging.getLogger(__name__)
-        self.model = "qwen2.5-coder:7b-instruct-q6_K"
-        self.completed_tasks = []
-
-    @staticmethod
-    def _generate_admin_prompt(task: Task):
-        # Need to replace the response format
-        admin_prompt = f"""
+from skill_library_json import SkillLibrary
+from taskplanner import TaskPlanner
+from utils.llm import LLMClient, get_default_client
+from utils.config import models
+from utils.sandbox import ExecutionPool
+from utils.checkpoint import PlanCheckpoint
+from utils.context import TaskContext, estimate_tokens
+from utils.error_index import ErrorSignatureIndex
+from utils.prompts import assemble, static_prompt
+from utils.retry import Budget, RetryPolicy, remaining_time
+from utils.session import SESSION_MODULE, ExecutionSession
+from utils.streaming import IncrementalJSONValidator, MalformedResponseError
+from utils.tracing import tracer
+from utils.validation import ValidationResult, undefined_names, validate_code
+
+
+_ADMIN_PROMPT = static_prompt("""
             You are a coding assistant that generates code to achieve a task. Your task is to return only the code. 
             The ultimate goal is to achieve the current task based on the user's original goal. Adhere to the output response at all times.
 
@@ -36,18 +46,50 @@ class TaskExecutor:
 
             You should only respond in the following format:
             json
-            {{"code": "generated python code"}}
+            {"code": "generated python code"}
 
             RESPONSE FORMAT:
             Question: Based on the information I listed above, generate the code.
             Answer: 
             json
-                {{"code": ""}}.
+                {"code": ""}.
 
-            Ensure the response {{"code": ""}} can be parsed by Python `json.loads`.
-        """
+            Ensure the response {"code": ""} can be parsed by Python `json.loads`.
+""")
+
+
+class TaskExecutor:
+    def __init__(self, max_workers: int = 4, client: LLMClient = None, execution_pool: ExecutionPool = None,
+                 prompt_token_budget: int = 3072, stream: bool = False, num_candidates: int = 1,
+                 skill_library: SkillLibrary = None, error_index: ErrorSignatureIndex = None,
+                 max_fix_attempts: int = 2, checkpoint: PlanCheckpoint = None, share_session: bool = True,
+                 retry_policy: RetryPolicy = None, planner: TaskPlanner = None,
+                 progress: Callable[[Dict], None] = None):
+        self.logger = logging.getLogger(__name__)
+        self.client = client or get_default_client()
+        self.execution_pool = execution_pool or ExecutionPool(size=max_workers)
+        self.model = models.coder
+        self.completed_tasks = []
+        self.max_workers = max_workers
+        self.prompt_token_budget = prompt_token_budget
+        self.stream = stream
+        self.num_candidates = num_candidates
+        self.skill_library = skill_library
+        self.max_fix_attempts = max_fix_attempts
+        self.checkpoint = checkpoint
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.planner = planner
+        self.progress = progress
+        self._plan_budget: Optional[Budget] = None
+        self._missing_models: Set[str] = set()
+        self.session = ExecutionSession() if share_session else None
+        self.context = TaskContext(include_signatures=self.session is None)
+        self.reflection = Reflection(models.reflection, client=self.client, error_index=error_index)
 
-        return admin_prompt
+    @staticmethod
+    def _generate_admin_prompt(task: Task):
+        # Built once at import time, the same bytes lead every code prompt so the server reuses its prompt cache
+        return _ADMIN_PROMPT
 
     # if we cant format response, call execute again
     def format_response(self, response):
@@ -59,89 +101,587 @@ class TaskExecutor:
             self.logger.info(f"Response from LLM: {response}")
             return response['message']['content']
 
-    def generate_and_execute_new_task(self, task: Task):
-        messages = [ollama.Message(role='system', content=self._generate_admin_prompt(task))]
-
-        # TODO Bug
+    def _build_messages(self, task: Task):
         """
-        In previous tasks, as each task is independent, 
-        I need to flow the information of previous tasks to each Task object
-        putting it as a chat would explode the context winodw
+        Blocks are ordered from the most to the least stable, so consecutive prompts share the longest prefix
+            1. The static system prompt
+            2. The goal, the same for every task of the plan
+            3. The session symbols and the digest of the completed tasks, which only grow during a plan
+            4. The current task, unchanged between retries
+            5. The feedback of the previous attempts
         """
+        system = self._generate_admin_prompt(task)
+        goal = f"The main goal is: {task.task_tracker['original_query']}"
+        user_content = f"The current task: {task.name}"
+        feedback = f"Feedback: {task.task_feedbacks}" if task.task_feedbacks else None
+
+        # Previous tasks are passed as a digest of their signatures and outputs, capped to the prompt budget
+        budget = self.prompt_token_budget - estimate_tokens(system + goal + user_content + (feedback or ''))
+
+        symbols = None
+        if self.session is not None and self.session.version:
+            symbols = (f"Functions and classes of the completed tasks are already defined, call them "
+                       f"directly or `from {SESSION_MODULE} import <name>` instead of rewriting them:\n"
+                       f"{self.session.render(token_budget=max(budget // 2, 0))}")
+            budget -= estimate_tokens(symbols)
+
+        completed_tasks = self.context.render(token_budget=max(budget, 0)) if len(self.context) else ''
+        if completed_tasks:
+            self.logger.debug(f"List of completed task: {completed_tasks}")
+
+        return assemble(system,
+                        ('user', goal),
+                        ('assistant', symbols),
+                        ('assistant', f'List of completed tasks:\n{completed_tasks}' if completed_tasks else None),
+                        ('user', user_content),
+                        ('user', feedback))
+
+    def _run_code(self, response) -> ExecutionResult:
+        if response:
+            with tracer.span('exec', 'exec') as span:
+                # Never let the code run past the deadline of its task or plan
+                result = self.execution_pool.run(response, timeout=self._exec_timeout(),
+                                                 session=self.session.payload() if self.session else None)
+                span.set(status=result.status, execution_time=result.execution_time)
+            self.logger.info(f"Executed in {result.execution_time:.2f}s, stdout: {result.stdout}")
+            return result
 
-        if task.retry_count > 0:
-            self.logger.info(f"List of completed task: {str(self.completed_tasks)}")
-            messages.append(
-                ollama.Message(role='assistant',
-                               content=f'List of completed tasks: {str(self.completed_tasks)}'))
-
-        if task.task_feedbacks:
-            messages.append(
-                ollama.Message(role='user',
-                               content=f"The main goal is: {task.task_tracker['original_query']}, The current task: {task.name}"
-                                       f"Feedback: {task.task_feedbacks}"))
         else:
-            messages.append(
-                ollama.Message(role='user',
-                               content=f"The main goal is: {task.task_tracker['original_query']}, The current task: {task.name}"))
+            return ExecutionResult(status='failure', output=response, error="No response generated")
 
-        response = ollama.chat(model=self.model,
-                               messages=messages,
-                               format='json')
-        response = self.format_response(response)
+    def _exec_timeout(self) -> Optional[float]:
+        remaining = remaining_time()
+        if remaining is None:
+            return None
+        return max(min(remaining, self.execution_pool.timeout), 1.0)
+
+    def _remember(self, task: Task, code: str, stdout: str):
+        self.completed_tasks.append(code)
+        self.context.add(task, code, stdout)
+        if self.session is not None:
+            registered = self.session.register(code)
+            if registered:
+                self.logger.info(f"Task {task.name} registered {registered} in the session")
+
+    def _uses_session(self, code: str) -> bool:
+        """Whether the code imports the session or reads a name it only gets from the session."""
+        if SESSION_MODULE in self.skill_library.package_dependencies(code):
+            return True
+        if self.session is None or not self.session.version:
+            return False
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return False
+        return bool({name for name, line in undefined_names(tree)} & self.session.names())
+
+    def _record_success(self, task: Task, result: ExecutionResult, store_skill: bool = True):
+        # Code using the session only runs next to the tasks of this plan, it is not a reusable skill
+        store_skill = store_skill and self.skill_library is not None and not self._uses_session(result.output)
+        self._remember(task, result.output, result.stdout)
+        if store_skill:
+            self.skill_library.add_skill(task, result.output, result.execution_time)
+
+    def _lookup_skill(self, task: Task):
+        if self.skill_library is None or task.retry_count > 0:
+            return None
+        return self.skill_library.lookup_skill(task)
+
+    async def _alookup_skill(self, task: Task):
+        if self.skill_library is None or task.retry_count > 0:
+            return None
+        return await self.skill_library.alookup_skill(task)
+
+    def _reuse_skill(self, task: Task, skill) -> Optional[ExecutionResult]:
+        """Runs a stored skill instead of generating code, returns None when it has to be regenerated."""
+        with tracer.span('skill.reuse', skill=skill.name) as span:
+            result = self._run_code(skill.code)
+            self.skill_library.record_execution(skill, result.status == 'success', result.execution_time)
+            span.set(status=result.status)
+
+        if result.status != 'success':
+            self.logger.info(f"Stored skill {skill.name} failed for task {task.name}, generating new code")
+            return None
+
+        self.logger.info(f"Task {task.name} reused stored skill {skill.name}")
+        self._record_success(task, result, store_skill=False)
+        return result
 
-        if response:
+    @staticmethod
+    def _code_validator():
+        return IncrementalJSONValidator('code', 'string')
+
+    def _model_missing(self, error: ollama.ResponseError, model: str) -> bool:
+        """Whether the server does not have the model, e.g. an escalation model that was never pulled."""
+        if error.status_code != 404 or model == self.model:
+            return False
+        self.logger.warning(f"Model {model} is not available ({error.error}), falling back to {self.model}")
+        self._missing_models.add(model)
+        return True
+
+    def _generate(self, messages, options=None, model=None):
+        model = model or self.model
+        try:
+            with tracer.span('generate', model=model, options=options):
+                return self._generate_response(messages, options, model)
+        except ollama.ResponseError as e:
+            if not self._model_missing(e, model):
+                raise
+        return self._generate(messages, options)
+
+    async def _agenerate(self, messages, options=None, model=None):
+        model = model or self.model
+        try:
+            with tracer.span('generate', model=model, options=options):
+                return await self._agenerate_response(messages, options, model)
+        except ollama.ResponseError as e:
+            if not self._model_missing(e, model):
+                raise
+        return await self._agenerate(messages, options)
+
+    def _generate_response(self, messages, options=None, model=None):
+        model = model or self.model
+        if self.stream:
+            response = self.client.chat_stream(model, messages, validator=self._code_validator, options=options)
+        else:
+            response = self.client.chat(model=model,
+                                        messages=messages,
+                                        format='json',
+                                        options=options)
+        return self.format_response(response)
+
+    async def _agenerate_response(self, messages, options=None, model=None):
+        model = model or self.model
+        if self.stream:
+            response = await self.client.achat_stream(model, messages, validator=self._code_validator,
+                                                      options=options)
+        else:
+            response = await self.client.achat(model=model,
+                                               messages=messages,
+                                               format='json',
+                                               options=options)
+        return self.format_response(response)
+
+    def _validate(self, response) -> ValidationResult:
+        with tracer.span('validate') as span:
+            if self.session is not None:
+                validation = validate_code(response, known_names=self.session.names(), known_modules=[SESSION_MODULE])
+            else:
+                validation = validate_code(response)
+            span.set(ok=validation.ok, errors=len(validation.errors))
+        if not validation.ok:
+            self.logger.warning(f"Generated code failed static checks: {validation.error}")
+        return validation
+
+    @staticmethod
+    def _fix_messages(messages, validation: ValidationResult):
+        """Sends the static check diagnostics straight back to the code model, without a reflection round trip."""
+        return messages + [
+            ollama.Message(role='assistant', content=json.dumps({'code': validation.code})),
+            ollama.Message(role='user',
+                           content=f"The code failed static checks before it was run:\n{validation.error}\n"
+                                   f"Fix these problems and respond with the complete corrected code "
+                                   f"in the same JSON format."),
+        ]
+
+    @staticmethod
+    def _cancelled_result() -> ExecutionResult:
+        return ExecutionResult(status='failure', output=None, error="Cancelled, another candidate passed")
+
+    def _generate_and_run(self, messages, options=None, model=None,
+                          cancelled: threading.Event = None) -> ExecutionResult:
+        """Generates and runs the code, stopping before the next model call or execution once cancelled is set."""
+        for attempt in range(self.max_fix_attempts + 1):
+            if cancelled is not None and cancelled.is_set():
+                return self._cancelled_result()
+            try:
+                response = self._generate(messages, options, model)
+            except MalformedResponseError as e:
+                return ExecutionResult(status='failure', output=None, error=str(e))
+
+            validation = self._validate(response)
+            if validation.ok:
+                if cancelled is not None and cancelled.is_set():
+                    return self._cancelled_result()
+                return self._run_code(validation.code)
+            messages = self._fix_messages(messages, validation)
+
+        return ExecutionResult(status='failure', output=validation.code, error=validation.error)
+
+    async def _agenerate_and_run(self, messages, options=None, model=None,
+                                 cancelled: threading.Event = None) -> ExecutionResult:
+        for attempt in range(self.max_fix_attempts + 1):
+            if cancelled is not None and cancelled.is_set():
+                return self._cancelled_result()
             try:
-                exec(response, locals())
-                self.completed_tasks.append(response)
-                return ExecutionResult(status='success', output=response)
-            except Exception as e:
-                error_message = traceback.format_exc()
-                return ExecutionResult(status='failure', output=response, error=error_message)
+                response = await self._agenerate(messages, options, model)
+            except MalformedResponseError as e:
+                return ExecutionResult(status='failure', output=None, error=str(e))
+
+            validation = self._validate(response)
+            if validation.ok:
+                if cancelled is not None and cancelled.is_set():
+                    return self._cancelled_result()
+                return await asyncio.to_thread(self._run_code, validation.code)
+            messages = self._fix_messages(messages, validation)
+
+        return ExecutionResult(status='failure', output=validation.code, error=validation.error)
+
+    def generate_and_execute_new_task(self, task: Task, model: str = None):
+        result = self._generate_and_run(self._build_messages(task), model=model)
+        if result.status == 'success':
+            self._record_success(task, result)
+        return result
 
-        else:
-            return ExecutionResult(status='failure', output=response, error="No response generated")
+    async def agenerate_and_execute_new_task(self, task: Task, model: str = None):
+        result = await self._agenerate_and_run(self._build_messages(task), model=model)
+        if result.status == 'success':
+            await asyncio.to_thread(self._record_success, task, result)
+        return result
+
+    def _candidate_options(self) -> List[Dict]:
+        """Spreads the sampling temperature of the candidates between 0.2 and 1.0."""
+        n = self.num_candidates
+        return [{'temperature': round(0.2 + 0.8 * i / max(n - 1, 1), 2), 'seed': i} for i in range(n)]
+
+    def generate_and_execute_candidates(self, task: Task, model: str = None) -> ExecutionResult:
+        """
+        Generates and executes num_candidates solutions concurrently.
+        The first successful candidate wins, the others stop before their next model call or execution.
+        A candidate raising, e.g. on a model error, counts as a failed candidate.
+        """
+        messages = self._build_messages(task)
+        cancelled = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.num_candidates)
+        futures = [pool.submit(contextvars.copy_context().run, self._generate_and_run, messages, options, model,
+                               cancelled)
+                   for options in self._candidate_options()]
+        failures = []
 
-    def execute_single_task(self, task: Task):
+        try:
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = ExecutionResult(status='failure', output=None, error=f"{type(e).__name__}: {e}")
+                if result.status == 'success':
+                    self.logger.info(f"Candidate {len(failures) + 1} of {len(futures)} passed for task {task.name}")
+                    self._record_success(task, result)
+                    return result
+                failures.append(result)
+        finally:
+            cancelled.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        return failures[0]
+
+    async def agenerate_and_execute_candidates(self, task: Task, model: str = None) -> ExecutionResult:
+        messages = self._build_messages(task)
+        cancelled = threading.Event()
+        pending = {asyncio.create_task(self._agenerate_and_run(messages, options, model, cancelled))
+                   for options in self._candidate_options()}
+        failures = []
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for candidate in done:
+                    try:
+                        result = candidate.result()
+                    except Exception as e:
+                        result = ExecutionResult(status='failure', output=None, error=f"{type(e).__name__}: {e}")
+                    if result.status == 'success':
+                        self.logger.info(f"Candidate {len(failures) + 1} of {self.num_candidates} passed "
+                                         f"for task {task.name}")
+                        await asyncio.to_thread(self._record_success, task, result)
+                        return result
+                    failures.append(result)
+        finally:
+            # An execution already handed to a thread finishes on its own, the event stops it from starting
+            cancelled.set()
+            for candidate in pending:
+                candidate.cancel()
+
+        return failures[0]
+
+    def execute_single_task(self, task: Task, model: str = None):
         self.logger.info(f"Executing task: {task.name}")
 
-        result = self.generate_and_execute_new_task(task)
+        if self.num_candidates > 1:
+            return self.generate_and_execute_candidates(task, model)
+
+        result = self.generate_and_execute_new_task(task, model)
 
         return result
 
-    def execute_task_with_retry_mechanism(self, task, status='failure'):
-        result = ExecutionResult(status='failure', output=None)
-        while status != 'success':
-            result = self.execute_single_task(task)
+    async def aexecute_single_task(self, task: Task, model: str = None):
+        self.logger.info(f"Executing task: {task.name}")
 
-            if result.status == 'success':
-                task.task_feedbacks = None
-                return result
+        if self.num_candidates > 1:
+            return await self.agenerate_and_execute_candidates(task, model)
 
-            task.retry_count += 1
+        result = await self.agenerate_and_execute_new_task(task, model)
+
+        return result
 
-            self.logger.warning(f"Task {task.name} failed, attempt {task.retry_count} "
-                                f"of {task.max_retries}. Error: {result.error}")
+    def notify(self, event: str, **fields):
+        """Reports a progress event, e.g. to the client of a server.py query, when a progress callback is set."""
+        if self.progress is None:
+            return
+        try:
+            self.progress({'event': event, 'time': time.time(), **fields})
+        except Exception as e:
+            self.logger.warning(f"Progress callback failed on {event}: {e}")
+
+    def _log_failure(self, task: Task, result: ExecutionResult):
+        task.retry_count += 1
+        self.notify('task_failed', id=task.id, name=task.name, attempt=task.retry_count, error=result.error)
+
+        self.logger.warning(f"Task {task.name} failed, attempt {task.retry_count} "
+                            f"of {self.retry_policy.retries_for(task)}. Error: {result.error}")
+
+    def _add_feedback(self, task: Task, feedback: str):
+        task.task_feedbacks = self.retry_policy.cap_feedbacks(task.task_feedbacks + [feedback])
+        if self.checkpoint is not None:
+            self.checkpoint.record_feedback(task, feedback)
+
+    def _stop_reason(self, task: Task, budget: Budget) -> Optional[str]:
+        reason = self.retry_policy.stop_reason(task, budget, self._plan_budget)
+        if reason is not None:
+            self.logger.warning(f"Giving up on task {task.name} after {task.retry_count} attempts: {reason}")
+        return reason
+
+    def _attempt_model(self, task: Task) -> str:
+        model = self.retry_policy.model_for(task, self.model)
+        if model in self._missing_models:
+            return self.model
+        if model != self.model:
+            self.logger.info(f"Escalating task {task.name} to {model}")
+        return model
+
+    def execute_task_with_retry_mechanism(self, task):
+        """
+        Generates and executes the task until it succeeds or the retry policy stops it
+            1. A stored skill is tried first
+            2. Every failure is reflected on, and the attempts are spaced by an exponential backoff
+            3. Repeated failures escalate to a larger model or ask the planner to rewrite the task
+        """
+        skill = self._lookup_skill(task)
+        if skill is not None:
+            result = self._reuse_skill(task, skill)
+            if result is not None:
+                return result
 
-            task.task_feedbacks.append(Reflection('mistral-nemo').feedback_with_reflection(task, result))
+        policy = self.retry_policy
+        with policy.task_budget().metered() as budget:
+            while True:
+                result = self.execute_single_task(task, self._attempt_model(task))
+                self.reflection.record_outcome(task, result.status == 'success')
+
+                if result.status == 'success':
+                    task.task_feedbacks = []
+                    return result
+
+                self._log_failure(task, result)
+                if self._stop_reason(task, budget):
+                    return result
+
+                if policy.should_replan(task) and self.planner is not None and \
+                        self.planner.replan_task(task, result.error):
+                    task.task_feedbacks = []
+                else:
+                    with tracer.span('reflect', task=task.name, retry=task.retry_count):
+                        self._add_feedback(task, self.reflection.feedback_with_reflection(task, result))
+
+                time.sleep(policy.delay(task))
+                # The reflection and the backoff may have used up the rest of the deadline
+                if self._stop_reason(task, budget):
+                    return result
+
+    async def aexecute_task_with_retry_mechanism(self, task):
+        skill = await self._alookup_skill(task)
+        if skill is not None:
+            result = await asyncio.to_thread(self._reuse_skill, task, skill)
+            if result is not None:
+                return result
 
-        return result
+        policy = self.retry_policy
+        with policy.task_budget().metered() as budget:
+            while True:
+                result = await self.aexecute_single_task(task, self._attempt_model(task))
+                self.reflection.record_outcome(task, result.status == 'success')
+
+                if result.status == 'success':
+                    task.task_feedbacks = []
+                    return result
+
+                self._log_failure(task, result)
+                if self._stop_reason(task, budget):
+                    return result
+
+                if policy.should_replan(task) and self.planner is not None and \
+                        await self.planner.areplan_task(task, result.error):
+                    task.task_feedbacks = []
+                else:
+                    with tracer.span('reflect', task=task.name, retry=task.retry_count):
+                        self._add_feedback(task, await self.reflection.afeedback_with_reflection(task, result))
+
+                await asyncio.sleep(policy.delay(task))
+                # The reflection and the backoff may have used up the rest of the deadline
+                if self._stop_reason(task, budget):
+                    return result
+
+    def _start_task(self, task: Task) -> float:
+        task.status = 'in_progress'
+        self.notify('task_started', id=task.id, name=task.name)
+        return time.perf_counter()
+
+    def _finish_task(self, task: Task, result: ExecutionResult, start: float) -> Response:
+        elapsed = time.perf_counter() - start
+        task.status = 'completed' if result.status == 'success' else 'failed'
+
+        self.logger.info(f"Task {task.name} finished with status {task.status} in {elapsed:.2f}s.")
+        self.logger.info(f"Response Generated {result.output}")
+        self.notify('task_finished', id=task.id, name=task.name, status=task.status, execution_time=elapsed,
+                    code=result.output, stdout=result.stdout)
+
+        if self.checkpoint is not None:
+            self.checkpoint.record_task(task, result, elapsed)
+
+        return Response(task.name, response=result.output, execution_time=elapsed)
+
+    def _restore_checkpoint(self, tasks: List[Task]) -> Dict[int, Response]:
+        """Responses of the tasks completed in the checkpoint, their code and output are put back in the context."""
+        responses = {}
+        if self.checkpoint is None:
+            return responses
 
-    def execute_task_list(self, tasks: List[Task]) -> List[Response]:
-        results = []
+        for task in tasks:
+            record = self.checkpoint.completed(task.id)
+            if record is None:
+                continue
+            task.status = 'completed'
+            self._remember(task, record['code'], record['stdout'])
+            responses[task.id] = Response(task.name, response=record['code'], execution_time=record['execution_time'])
+            self.logger.info(f"Task {task.name} restored from the checkpoint")
+        return responses
+
+    def _waiting_on(self, tasks: List[Task], done: Dict[int, Response]) -> Dict[int, Set[int]]:
+        waiting_on = self._resolve_dependencies(tasks)
+        for deps in waiting_on.values():
+            deps.difference_update(done)
+        return waiting_on
+
+    def _plan_exhausted(self, task: Task) -> Optional[ExecutionResult]:
+        reason = self._plan_budget.exceeded() if self._plan_budget is not None else None
+        if reason is None:
+            return None
+        self.logger.warning(f"Skipping task {task.name}: plan {reason}")
+        return ExecutionResult(status='failure', output=None, error=f"Plan {reason}")
+
+    def _run_task(self, task: Task) -> Response:
+        with tracer.span('task', task_id=task.id, task=task.name) as span:
+            start = self._start_task(task)
+            result = self._plan_exhausted(task) or self.execute_task_with_retry_mechanism(task)
+            span.set(status=result.status, retries=task.retry_count)
+            return self._finish_task(task, result, start)
+
+    async def _arun_task(self, task: Task) -> Response:
+        with tracer.span('task', task_id=task.id, task=task.name) as span:
+            start = self._start_task(task)
+            result = self._plan_exhausted(task) or await self.aexecute_task_with_retry_mechanism(task)
+            span.set(status=result.status, retries=task.retry_count)
+            return self._finish_task(task, result, start)
+
+    def _resolve_dependencies(self, tasks: List[Task]) -> Dict[int, Set[int]]:
+        """
+        Maps each task id to the ids it waits on.
+        Unknown ids are dropped and a dependency cycle is broken at its lowest task id.
+        """
+        task_ids = {task.id for task in tasks}
+        dependencies = {task.id: {dep for dep in task.dependencies if dep in task_ids and dep != task.id}
+                        for task in tasks}
+
+        remaining = {task_id: set(deps) for task_id, deps in dependencies.items()}
+        while remaining:
+            ready = [task_id for task_id, deps in remaining.items() if not deps]
+            if not ready:
+                task_id = min(remaining)
+                self.logger.warning(f"Dependency cycle detected, task {task_id} will not wait on "
+                                    f"{sorted(dependencies[task_id])}")
+                dependencies[task_id].clear()
+                ready = [task_id]
+            for task_id in ready:
+                del remaining[task_id]
+                for deps in remaining.values():
+                    deps.discard(task_id)
+
+        return dependencies
+
+    def _log_timings(self, tasks: List[Task], responses: Dict[int, Response], total_time: float):
+        serial_time = sum(response.execution_time for response in responses.values())
 
-        # TODO the previously completed tasks are not propagating properly
         for task in tasks:
-            result = self.execute_task_with_retry_mechanism(task)
+            self.logger.info(f"Task {task.id} {task.name}: {responses[task.id].execution_time:.2f}s")
+        self.logger.info(f"Tasks completed successfully in {total_time:.2f}s "
+                         f"(sum of task times {serial_time:.2f}s, speedup {serial_time / max(total_time, 1e-9):.2f}x)")
+
+    def execute_task_list(self, tasks: List[Task], max_workers: int = None) -> List[Response]:
+        """
+        Schedules the tasks as a DAG on a bounded thread pool.
+            1. A task is started as soon as all of its dependencies are finished
+            2. Independent tasks are generated and executed at the same time
+        """
+        max_workers = max_workers or self.max_workers
+        responses = self._restore_checkpoint(tasks)
+        waiting_on = self._waiting_on(tasks, responses)
+        pending = {task.id: task for task in tasks if task.id not in responses}
+        running = {}
+
+        start = time.perf_counter()
+        self._plan_budget = self.retry_policy.plan_budget()
+        with self._plan_budget.metered(), ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                for task in [task for task in pending.values() if not waiting_on[task.id]]:
+                    del pending[task.id]
+                    running[pool.submit(contextvars.copy_context().run, self._run_task, task)] = task
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    responses[task.id] = future.result()
+                    for deps in waiting_on.values():
+                        deps.discard(task.id)
+
+        self._log_timings(tasks, responses, time.perf_counter() - start)
+
+        return [responses[task.id] for task in tasks]
+
+    async def aexecute_task_list(self, tasks: List[Task], max_concurrency: int = None) -> List[Response]:
+        """
+        Async counterpart of execute_task_list, every task is a coroutine waiting on its dependencies.
+        At most max_concurrency tasks are generating or executing at the same time.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_workers)
+        responses = self._restore_checkpoint(tasks)
+        waiting_on = self._waiting_on(tasks, responses)
+        finished = {task.id: asyncio.Event() for task in tasks}
 
-            results.append(Response(task.name, response=result.output))
+        async def run(task: Task):
+            for dep in waiting_on[task.id]:
+                await finished[dep].wait()
+            async with semaphore:
+                responses[task.id] = await self._arun_task(task)
+            finished[task.id].set()
 
-            self.logger.info(f"Task {task.name} is completed successfully.")
-            self.logger.info(f"Response Generated {result.output}")
+        start = time.perf_counter()
+        self._plan_budget = self.retry_policy.plan_budget()
+        with self._plan_budget.metered():
+            await asyncio.gather(*(run(task) for task in tasks if task.id not in responses))
 
-        self.logger.info(f"Tasks completed successfully.")
-        return results
+        self._log_timings(tasks, responses, time.perf_counter() - start)
 
+        return [responses[task.id] for task in tasks]
 
 if __name__ == "__main__":
     logging.basicConfig(
@@ -160,7 +700,8 @@ if __name__ == "__main__":
             id=2,
             name="format_greeting",
             description="Format a greeting message for Alice",
-            status='pending'
+            status='pending',
+            dependencies=[1]
         )
     ]
 
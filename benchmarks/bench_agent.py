@@ -0,0 +1,185 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from functools import partial
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from action import TaskExecutor
+from reflection import Reflection
+from taskplanner import TaskPlanner
+from utils.llm import LLMClient
+from utils.model import ExecutionResult
+from utils.sandbox import ExecutionPool
+from utils.stub_server import StubChatServer, scripted_reply
+from utils.tracing import tracer
+
+"""
+Benchmarks the agent loop itself against the scripted stub chat server.
+Every plan size runs TaskPlanner -> TaskExecutor.execute_task_list, followed by a batch of
+Reflection.feedback_with_reflection calls, and the results are written as JSON per commit.
+"""
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def slope(values: List[float]) -> float:
+    """Least-squares growth per step of a series."""
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    denominator = sum((x - mean_x) ** 2 for x in range(n))
+    return numerator / denominator
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_plan(args, plan_size: int, pool: ExecutionPool) -> Dict:
+    server = StubChatServer(latency=args.latency, token_rate=args.token_rate, error_rate=args.error_rate,
+                            bad_code_rate=args.bad_code_rate, seed=args.seed, prompt_rate=args.prompt_rate,
+                            reply=partial(scripted_reply, plan_size=plan_size))
+    with server:
+        client = LLMClient(host=server.url, default_concurrency=args.workers)
+        planner = TaskPlanner('stub-planner', client=client, stream=args.stream)
+        executor = TaskExecutor(max_workers=args.workers, client=client, execution_pool=pool, stream=args.stream)
+
+        tracer.clear()
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        query = f"Benchmark plan of {plan_size} tasks"
+        tasks = planner.make_tasks_list(planner.generate_plan(query)[0], query)
+        plan_time = time.perf_counter() - start
+        responses = executor.execute_task_list(tasks)
+        total_time = time.perf_counter() - start
+
+        reflection = Reflection('stub-reflection', client=client)
+        failure = ExecutionResult(status='failure', output="print(undefined_name)",
+                                  error="NameError: name 'undefined_name' is not defined")
+        reflection_start = time.perf_counter()
+        for task in tasks[:args.reflections]:
+            reflection.feedback_with_reflection(task, failure)
+        reflection_time = time.perf_counter() - reflection_start
+
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        code_prompts = [tokens for kind, tokens in server.requests if kind == 'code']
+        latencies = [response.execution_time for response in responses]
+        llm_spans = [span for span in tracer.spans if span.name.startswith('llm.chat')]
+
+        return {
+            'plan_size': plan_size,
+            'tasks': len(tasks),
+            'plan_time': plan_time,
+            'total_time': total_time,
+            'throughput_tasks_per_sec': len(tasks) / total_time if total_time else 0.0,
+            'task_latency': {'p50': percentile(latencies, 50),
+                             'p95': percentile(latencies, 95),
+                             'p99': percentile(latencies, 99),
+                             'max': max(latencies, default=0.0)},
+            'llm_calls': len(server.requests),
+            'llm_time': sum(span.duration for span in llm_spans),
+            'reflections': len([span for span in tracer.spans if span.name == 'reflect']),
+            'reflection_feedback_time': reflection_time,
+            'prompt_tokens': {'first': code_prompts[0] if code_prompts else 0,
+                              'last': code_prompts[-1] if code_prompts else 0,
+                              'mean': sum(code_prompts) / len(code_prompts) if code_prompts else 0,
+                              'growth_per_task': slope(code_prompts)},
+            'prompt_prefix': client.prefixes.stats(),
+            'peak_traced_memory_bytes': peak_memory,
+        }
+
+
+def compare(current: Dict, baseline_path: str):
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    baseline_runs = {run['plan_size']: run for run in baseline['runs']}
+    for run in current['runs']:
+        old = baseline_runs.get(run['plan_size'])
+        if old is None:
+            continue
+        for metric, value, previous in (
+                ('throughput', run['throughput_tasks_per_sec'], old['throughput_tasks_per_sec']),
+                ('p95 latency', run['task_latency']['p95'], old['task_latency']['p95']),
+                ('prompt growth', run['prompt_tokens']['growth_per_task'], old['prompt_tokens']['growth_per_task']),
+                ('peak memory', run['peak_traced_memory_bytes'], old['peak_traced_memory_bytes'])):
+            change = (value - previous) / previous * 100 if previous else 0.0
+            print(f"{run['plan_size']:>4} tasks {metric:<14} {previous:>12.4f} -> {value:>12.4f} ({change:+.1f}%)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop against a local stub chat server")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds before every stub reply")
+    parser.add_argument('--token-rate', type=float, default=0.0, help="Stub chunks per second, 0 is unlimited")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of HTTP 500 replies")
+    parser.add_argument('--bad-code-rate', type=float, default=0.0, help="Fraction of code replies that raise")
+    parser.add_argument('--prompt-rate', type=float, default=0.0,
+                        help="Stub seconds per prompt token not served from its prompt cache")
+    parser.add_argument('--reflections', type=int, default=10, help="Reflection calls timed per plan")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Defaults to benchmarks/results/<commit>.json")
+    parser.add_argument('--compare', default=None, help="Previous results JSON to compare against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    with ExecutionPool(size=args.workers) as pool:
+        runs = [run_plan(args, size, pool) for size in args.sizes]
+
+    results = {
+        'commit': commit,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'runs': runs,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for run in runs:
+        print(f"{run['plan_size']:>4} tasks: {run['throughput_tasks_per_sec']:.2f} tasks/s, "
+              f"p50 {run['task_latency']['p50']:.3f}s p95 {run['task_latency']['p95']:.3f}s "
+              f"p99 {run['task_latency']['p99']:.3f}s, prompt growth "
+              f"{run['prompt_tokens']['growth_per_task']:.1f} tokens/task, "
+              f"peak {run['peak_traced_memory_bytes'] / 1e6:.1f} MB")
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
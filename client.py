@@ -0,0 +1,119 @@
+"""
+Thin client of the agent server started with `python main.py --serve`.
+Only the standard library is imported, so sending a query costs no model, ollama or index loading.
+"""
+import argparse
+import http.client
+import json
+import socket
+import sys
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class AgentClient:
+    def __init__(self, socket_path: str = '.cache/agent.sock', url: Optional[str] = None,
+                 timeout: Optional[float] = None):
+        self.socket_path = socket_path
+        self.url = url
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.url:
+            parsed = urlparse(self.url)
+            return http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=self.timeout)
+        return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, body: Dict = None) -> http.client.HTTPResponse:
+        connection = self._connection()
+        payload = json.dumps(body).encode() if body is not None else None
+        connection.request(method, path, body=payload, headers={'Content-Type': 'application/json'})
+        return connection.getresponse()
+
+    def _json(self, method: str, path: str) -> Dict:
+        return json.loads(self._request(method, path).read())
+
+    def health(self) -> Dict:
+        return self._json('GET', '/health')
+
+    def stats(self) -> Dict:
+        return self._json('GET', '/stats')
+
+    def shutdown(self) -> Dict:
+        return self._json('POST', '/shutdown')
+
+    def query(self, query: str, query_id=None) -> Iterator[Dict]:
+        """Yields the progress events of the query as they arrive, the last one is its result."""
+        response = self._request('POST', '/query', {'query': query} if query_id is None
+                                 else {'query': query, 'id': query_id})
+        if response.status != 200:
+            raise RuntimeError(json.loads(response.read()).get('error', f"HTTP {response.status}"))
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _describe(event: Dict) -> str:
+    kind = event['event']
+    if kind == 'plan':
+        return f"planned {len(event['tasks'])} tasks: " + ', '.join(task['name'] for task in event['tasks'])
+    if kind == 'task_started':
+        return f"task {event['id']} {event['name']} started"
+    if kind == 'task_failed':
+        error = (event.get('error') or '').strip().splitlines()
+        return f"task {event['id']} {event['name']} failed attempt {event['attempt']}: {error[-1] if error else ''}"
+    if kind == 'task_finished':
+        return f"task {event['id']} {event['name']} {event['status']} in {event['execution_time']:.2f}s"
+    if kind == 'result':
+        return f"query {event['id']} {event['status']}" + (f" in {event['elapsed']:.2f}s" if 'elapsed' in event else '') \
+            + (f": {event['error']}" if event.get('error') else '')
+    return f"{kind} {event.get('id', '')}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Send a query to the agent server started with main.py --serve")
+    parser.add_argument('query', nargs='?', default=None)
+    parser.add_argument('--socket', default='.cache/agent.sock', help="Unix socket of the server")
+    parser.add_argument('--url', default=None, help="TCP address of the server, e.g. http://127.0.0.1:8765")
+    parser.add_argument('--id', default=None, help="Query id, also the checkpoint name with --checkpoint-dir")
+    parser.add_argument('--json', action='store_true', help="Print the raw progress events")
+    parser.add_argument('--stats', action='store_true', help="Print the cache, index and timing stats")
+    parser.add_argument('--shutdown', action='store_true', help="Stop the server")
+    args = parser.parse_args(argv)
+
+    client = AgentClient(socket_path=args.socket, url=args.url)
+    try:
+        if args.stats or args.shutdown:
+            print(json.dumps(client.stats() if args.stats else client.shutdown(), indent=2))
+            return 0
+        if args.query is None:
+            parser.error("a query is required")
+
+        status = 'error'
+        for event in client.query(args.query, args.id):
+            print(json.dumps(event, default=str) if args.json else _describe(event), flush=True)
+            if event['event'] == 'result':
+                status = event['status']
+        return 0 if status == 'success' else 1
+    except (ConnectionError, FileNotFoundError) as e:
+        print(f"No agent server at {args.url or args.socket} ({e}), start one with `python main.py --serve`",
+              file=sys.stderr)
+        return 2
+    except RuntimeError as e:
+        print(f"Query rejected: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,137 @@
-import ollama
+import argparse
+import asyncio
+import json
 import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
 from taskplanner import TaskPlanner
-from reflection import Reflection
 from action import TaskExecutor
+from service import AgentService
+from utils.checkpoint import PlanCheckpoint
+from utils.config import models
+from utils.model import Task
+from utils.tracing import tracer
+
+
+def _resumed_tasks(executor: TaskExecutor) -> Optional[List[Task]]:
+    checkpoint = executor.checkpoint
+    return checkpoint.restore_tasks() if checkpoint is not None and checkpoint.started else None
+
+
+def _checkpoint_plan(executor: TaskExecutor, user_query: str, task_list: List[Task]):
+    if executor.checkpoint is not None:
+        executor.checkpoint.start(user_query, task_list)
+
+
+def run(planner: TaskPlanner, executor: TaskExecutor, user_query: str):
+    task_list, plan_key = _resumed_tasks(executor), None
+    if task_list is None:
+        tasks, plan_key = planner.generate_plan(user_query)
+        task_list = planner.make_tasks_list(tasks, user_query)
+        _checkpoint_plan(executor, user_query, task_list)
+
+    responses = executor.execute_task_list(task_list)
+    planner.record_outcome(plan_key, task_list)
+    return responses
+
+
+async def arun(planner: TaskPlanner, executor: TaskExecutor, user_query: str):
+    task_list, plan_key = _resumed_tasks(executor), None
+    if task_list is None:
+        tasks, plan_key = await planner.agenerate_plan(user_query)
+        task_list = planner.make_tasks_list(tasks, user_query)
+        _checkpoint_plan(executor, user_query, task_list)
+
+    responses = await executor.aexecute_task_list(task_list)
+    planner.record_outcome(plan_key, task_list)
+    return responses
+
+
+def read_queries(path: str) -> Iterator[Dict]:
+    """Yields {"id", "query"} records from a JSONL file of objects or plain strings, ids default to the line number."""
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {'query': record}
+            record.setdefault('id', line_number)
+            yield record
+
+
+async def arun_query(planner: TaskPlanner, executor: TaskExecutor, record: Dict) -> Dict:
+    start = time.perf_counter()
+    result = {'id': record['id'], 'query': record['query']}
+    try:
+        task_list, plan_key = _resumed_tasks(executor), None
+        if task_list is None:
+            tasks, plan_key = await planner.agenerate_plan(record['query'])
+            task_list = planner.make_tasks_list(tasks, record['query'])
+            _checkpoint_plan(executor, record['query'], task_list)
+        executor.notify('plan', query_id=record['id'],
+                        tasks=[{'id': task.id, 'name': task.name, 'status': task.status,
+                                'dependencies': task.dependencies} for task in task_list])
+        responses = await executor.aexecute_task_list(task_list)
+        planner.record_outcome(plan_key, task_list)
+    except Exception as e:
+        logging.exception(f"Query {record['id']} failed")
+        result.update(status='error', error=f"{type(e).__name__}: {e}", elapsed=time.perf_counter() - start)
+        return result
+
+    result.update(status='success' if all(task.status == 'completed' for task in task_list) else 'failure',
+                  elapsed=time.perf_counter() - start,
+                  tasks=[{'id': task.id, 'name': task.name, 'status': task.status,
+                          'execution_time': response.execution_time, 'code': response.response}
+                         for task, response in zip(task_list, responses)])
+    return result
+
+
+def finished_ids(output: str) -> Set:
+    """Ids of the queries already written to a batch output, a torn last line is ignored."""
+    ids = set()
+    if os.path.exists(output):
+        with open(output, 'r') as f:
+            for line in f:
+                try:
+                    ids.add(json.loads(line)['id'])
+                except (ValueError, KeyError):
+                    continue
+    return ids
+
+
+async def arun_batch(records: Iterable[Dict], output: str, planner: TaskPlanner,
+                     make_executor: Callable[[Dict], TaskExecutor], max_queries: int = 8) -> Dict[str, int]:
+    """
+    Runs the plan / execute pipeline of every query concurrently, at most max_queries at a time.
+    Every query gets its own TaskExecutor, and its result is appended to the output JSONL as soon as it finishes.
+    Queries already in the output are skipped, so an interrupted batch is resumed by running it again.
+    """
+    semaphore = asyncio.Semaphore(max_queries)
+    counts = {'success': 0, 'failure': 0, 'error': 0}
+    done = finished_ids(output)
+    records = [record for record in records if record['id'] not in done]
+    if done:
+        logging.info(f"Skipping {len(done)} queries already in {output}")
+
+    async def run_record(record: Dict) -> Dict:
+        async with semaphore:
+            with tracer.span('query', query_id=record['id']):
+                return await arun_query(planner, make_executor(record), record)
+
+    with open(output, 'a') as f:
+        for finished in asyncio.as_completed([run_record(record) for record in records]):
+            result = await finished
+            f.write(json.dumps(result, default=str) + '\n')
+            f.flush()
+            counts[result['status']] += 1
+            logging.info(f"Query {result['id']} finished with status {result['status']} in {result['elapsed']:.2f}s "
+                         f"({sum(counts.values())} done)")
+
+    return counts
+
 
 if __name__ == "__main__":
     logging.basicConfig(
@@ -10,15 +139,92 @@ if __name__ == "__main__":
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
 
-    planner = TaskPlanner('mistral-nemo')
-    executor = TaskExecutor()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query', default="Generate a animation of the word Pallavi with 1s and 0s like in the Matrix Movie")
+    parser.add_argument('--host', default=None, help="Ollama host, e.g. a local stub chat server")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="Run the asyncio pipeline")
+    parser.add_argument('--concurrency', type=int, default=2, help="In-flight requests per model in async mode")
+    parser.add_argument('--cache-dir', default='.cache/chat', help="On-disk tier of the chat completion cache")
+    parser.add_argument('--no-cache', action='store_true', help="Always call the model")
+    parser.add_argument('--stream', action='store_true', help="Stream and validate responses, retrying malformed ones early")
+    parser.add_argument('--candidates', type=int, default=1, help="Code candidates generated concurrently per attempt")
+    parser.add_argument('--trace', default=None, help="Write spans to TRACE.jsonl and TRACE.chrome.json")
+    parser.add_argument('--skills', default=None,
+                        help="Skill library (.json, or .db for the SQLite store), known tasks reuse stored code")
+    parser.add_argument('--batch', default=None, help="JSONL file of queries, run concurrently with the async pipeline")
+    parser.add_argument('--output', default='results.jsonl', help="Batch results, one JSON record per query")
+    parser.add_argument('--max-queries', type=int, default=8,
+                        help="Queries in flight at the same time in batch and server mode")
+    parser.add_argument('--llm-concurrency', type=int, default=None, help="In-flight LLM requests across all models")
+    parser.add_argument('--exec-workers', type=int, default=4, help="Code execution worker processes")
+    parser.add_argument('--reflection-index', default='.cache/reflections.json',
+                        help="Reflections indexed by error signature, an empty path always calls the model")
+    parser.add_argument('--plan-cache', default='.cache/plans.json',
+                        help="Plans of previous queries reused for similar queries, an empty path always plans")
+    parser.add_argument('--plan-threshold', type=float, default=0.92,
+                        help="Minimum cosine similarity of two queries sharing a plan")
+    parser.add_argument('--no-adapt-plans', action='store_true',
+                        help="Reuse the cached plan of a similar, not identical, query unchanged instead of asking "
+                             "the planner to adjust it")
+    parser.add_argument('--checkpoint', default=None,
+                        help="Log the plan execution to CHECKPOINT.jsonl, an existing log is resumed")
+    parser.add_argument('--resume', default=None, help="Resume the plan execution logged in a checkpoint file")
+    parser.add_argument('--checkpoint-dir', default=None, help="One checkpoint per query in batch and server mode")
+    parser.add_argument('--no-affinity', action='store_true',
+                        help="Send requests as they come instead of grouping them by model")
+    parser.add_argument('--max-retries', type=int, default=None, help="Attempts per task, the task's own when unset")
+    parser.add_argument('--task-deadline', type=float, default=300.0, help="Seconds a task may spend on retries")
+    parser.add_argument('--plan-deadline', type=float, default=None, help="Seconds the whole plan may take")
+    parser.add_argument('--task-tokens', type=int, default=32000, help="LLM tokens a task may spend on retries")
+    parser.add_argument('--plan-tokens', type=int, default=None, help="LLM tokens the whole plan may spend")
+    parser.add_argument('--escalate-after', type=int, default=None,
+                        help=f"Failed attempts before the code is generated by {models.escalation}, "
+                             f"which must be pulled, off when unset")
+    parser.add_argument('--replan-after', type=int, default=None,
+                        help="Failed attempts before the planner is asked to rewrite the task")
+    parser.add_argument('--compact-skills', action='store_true',
+                        help="Merge the near-duplicate skills of the --skills library and exit")
+    parser.add_argument('--serve', action='store_true',
+                        help="Keep the models, execution pool and indexes loaded and answer queries sent by client.py")
+    parser.add_argument('--socket', default='.cache/agent.sock', help="Unix socket of the server")
+    parser.add_argument('--port', type=int, default=None, help="Serve over TCP on this port instead of the socket")
+    args = parser.parse_args()
+
+    if args.compact_skills and not args.skills:
+        parser.error("--compact-skills needs a --skills library")
+
+    # Without --trace only the per-stage totals are kept, a server would otherwise hold every span it ever ran
+    tracer.keep_spans = bool(args.trace)
+    service = AgentService.from_args(args)
+
+    if args.compact_skills:
+        logging.info(f"Skill library compacted: {service.skill_library.compact()}")
+    elif args.serve:
+        from server import serve
 
-    user_query = "Generate a animation of the word Pallavi with 1s and 0s like in the Matrix Movie"
+        serve(service, socket_path=args.socket, port=args.port, max_queries=args.max_queries)
+    elif args.batch:
+        counts = asyncio.run(arun_batch(read_queries(args.batch), args.output, service.planner, service.executor_for,
+                                        max_queries=args.max_queries))
+        logging.info(f"Batch finished: {counts}, results in {args.output}")
+    else:
+        user_query = args.query
+        checkpoint = PlanCheckpoint(args.resume or args.checkpoint) if args.resume or args.checkpoint else None
+        if args.resume and not checkpoint.started:
+            parser.error(f"{args.resume} holds no plan to resume")
+        if checkpoint is not None and checkpoint.started:
+            user_query = checkpoint.query
 
-    tasks = planner.generate_plan(user_query)
-    task_list = planner.make_tasks_list(tasks)
+        if args.use_async:
+            response = asyncio.run(arun(service.planner, service.make_executor(checkpoint), user_query))
+        else:
+            response = run(service.planner, service.make_executor(checkpoint), user_query)
 
-    response = executor.execute_task_list(task_list)
+        logging.info(f"{user_query} Executed Successfully")
+        logging.info(f"{response}")
 
-    logging.info(f"{user_query} Executed Successfully")
-    logging.info(f"{response}")
+    service.log_stats()
+    service.close()
+    if args.trace:
+        tracer.export_jsonl(f"{args.trace}.jsonl")
+        tracer.export_chrome_trace(f"{args.trace}.chrome.json")
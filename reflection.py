@@ -1,27 +1,13 @@
 import logging
 from typing import Dict
 
-import ollama
-
 from utils.model import Task, ExecutionResult, Message
+from utils.error_index import ErrorSignatureIndex, error_signature
+from utils.llm import LLMClient, get_default_client
+from utils.prompts import assemble, static_prompt
 
 
-class Reflection:
-    """
-    Reflection Class for LLM Client
-        1. Maintains a history of chats along
-        2. Returns a successfully generated response
-    """
-
-    def __init__(self, llm_client: any):
-        self.llm = llm_client
-        self.history: Dict[str, str] = {}
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
-
-    @staticmethod
-    def generate_reflection_prompt():
-        reflection_prompt = """
+_REFLECTION_PROMPT = static_prompt("""
         you are a Python programming assistant. You will be given some python code. 
         Your goal is to write a few sentences to explain why your implementation is wrong as indicated by errors. 
         You will need this as a hint when you try again later.
@@ -41,43 +27,75 @@ class Reflection:
                 task: str
                 reflection: str
             }}
-        """
+""")
 
-        return reflection_prompt
 
-    def generate_reflection(self, reflection_prompt, code_response, user_prompt):
-        messages = [
-            ollama.Message(role='system', content=reflection_prompt),
-            ollama.Message(role='assistant', content=f'Your code response: {str(code_response)}'),
-            ollama.Message(role='user', content=user_prompt)
-        ]
+class Reflection:
+    """
+    Reflection Class for LLM Client
+        1. Maintains a history of chats along
+        2. Returns a successfully generated response
+        3. With an ErrorSignatureIndex, failures with a known error signature reuse an indexed reflection
+           instead of calling the model, and the outcome of the next attempt is recorded against it
+    """
 
-        response = ollama.chat(model=self.llm,
-                               messages=messages,
-                               format='json')
+    def __init__(self, llm_client: any, client: LLMClient = None, error_index: ErrorSignatureIndex = None):
+        self.llm = llm_client
+        self.client = client or get_default_client()
+        self.error_index = error_index
+        self.history: Dict[str, str] = {}
+        self._pending: Dict[int, str] = {}
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.DEBUG)
+
+    @staticmethod
+    def generate_reflection_prompt():
+        return _REFLECTION_PROMPT
+
+    @staticmethod
+    def _build_messages(reflection_prompt, code_response, user_prompt, task_prompt=None):
+        # The task stays the same between the attempts, the code and the error change with every attempt
+        return assemble(reflection_prompt,
+                        ('user', task_prompt),
+                        ('assistant', f'Your code response: {str(code_response)}'),
+                        ('user', user_prompt))
+
+    def generate_reflection(self, reflection_prompt, code_response, user_prompt, task_prompt=None):
+        messages = self._build_messages(reflection_prompt, code_response, user_prompt, task_prompt)
+
+        response = self.client.chat(model=self.llm,
+                                    messages=messages,
+                                    format='json')
 
         return response['message']['content']
 
-    def feedback_with_reflection(self, task: Task, result: ExecutionResult):
+    async def agenerate_reflection(self, reflection_prompt, code_response, user_prompt, task_prompt=None):
+        messages = self._build_messages(reflection_prompt, code_response, user_prompt, task_prompt)
+
+        response = await self.client.achat(model=self.llm,
+                                           messages=messages,
+                                           format='json')
+
+        return response['message']['content']
+
+    @staticmethod
+    def _build_task_prompt(task: Task):
+        return f"Task: {task.name}\nTask Description: {task.description}"
+
+    def _build_user_prompt(self, task: Task, result: ExecutionResult):
+        """What went wrong in this attempt, the task and the code are sent in the messages before it."""
         if result.error:
-            user_prompt = (f"Task: {task.name}"
-                           f"Task Description: {task.description}"
-                           f"Task Response: {result.output}"
-                           f"\nError occured during execution of {task.name}: {task.description}: {result.error}")
+            user_prompt = f"Error occured during execution of {task.name}: {task.description}: {result.error}"
 
             self.logger.info(f"Error encountered and passed to LLM: {result.error}")
         else:
-            user_prompt = (f"Task: {task.name}"
-                           f"Task: {str(task.description)}"
-                           f"Task Response: {str(result.output)}"
-                           f"\nNo response was generated for {str(task)}: {str(task.description)}")
+            user_prompt = f"No response was generated for {task.name}: {task.description}"
 
             self.logger.info(f"No response was generated by the LLM: {result.error}")
 
-        reflection_prompt = self.generate_reflection_prompt()
-
-        reflection_response = self.generate_reflection(reflection_prompt, result.output, user_prompt)
+        return user_prompt
 
+    def _build_feedback(self, task: Task, result: ExecutionResult, reflection_response):
         feedback_message = f"""For Task: {task.description} 
                                Task Response: {result.output}, 
                                An Error occurred while executing the code, the feedback {reflection_response} is provided to you, 
@@ -87,6 +105,50 @@ class Reflection:
 
         return feedback_message
 
+    def _indexed_reflection(self, task: Task, result: ExecutionResult):
+        signature = error_signature(result.error) if self.error_index is not None else None
+        if signature is None:
+            return None, None
+
+        key = self.error_index.lookup(signature)
+        if key is None:
+            return signature, None
+
+        self.logger.info(f"Reusing indexed reflection for {signature}")
+        self._pending[task.id] = key
+        return signature, self.error_index.reflection(key)
+
+    def _index_reflection(self, task: Task, signature, reflection_response):
+        if signature is not None:
+            self._pending[task.id] = self.error_index.add(signature, reflection_response)
+
+    def record_outcome(self, task: Task, success: bool):
+        """Called after the attempt that followed a reflection, counts whether the reflection helped."""
+        key = self._pending.pop(task.id, None)
+        if key is not None:
+            self.error_index.record_outcome(key, success)
+
+    def feedback_with_reflection(self, task: Task, result: ExecutionResult):
+        signature, reflection_response = self._indexed_reflection(task, result)
+
+        if reflection_response is None:
+            user_prompt = self._build_user_prompt(task, result)
+            reflection_response = self.generate_reflection(self.generate_reflection_prompt(), result.output,
+                                                           user_prompt, self._build_task_prompt(task))
+            self._index_reflection(task, signature, reflection_response)
+
+        return self._build_feedback(task, result, reflection_response)
+
+    async def afeedback_with_reflection(self, task: Task, result: ExecutionResult):
+        signature, reflection_response = self._indexed_reflection(task, result)
+
+        if reflection_response is None:
+            user_prompt = self._build_user_prompt(task, result)
+            reflection_response = await self.agenerate_reflection(self.generate_reflection_prompt(), result.output,
+                                                                  user_prompt, self._build_task_prompt(task))
+            self._index_reflection(task, signature, reflection_response)
+
+        return self._build_feedback(task, result, reflection_response)
 
 if __name__ == "__main__":
     logging.basicConfig(
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import re
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+from main import arun_query
+from service import AgentService
+from utils.tracing import tracer
+
+
+def _valid_id(query_id) -> bool:
+    if isinstance(query_id, int) and not isinstance(query_id, bool):
+        return True
+    return isinstance(query_id, str) and re.fullmatch(r'[\w.-]+', query_id) is not None and \
+        query_id.strip('.') != ''
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the agent server
+        1. POST /query {"query", "id"?} streams the progress as JSON lines, the last one is the result
+        2. GET /health and GET /stats, POST /shutdown stops the server
+    """
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, body: Dict):
+        payload = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'running': self.server.running})
+        elif self.path == '/stats':
+            self._send_json(200, self.server.service.stats())
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path == '/shutdown':
+            self._send_json(200, {'status': 'stopping'})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+        if self.path != '/query':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+
+        try:
+            record = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(record, dict) or not isinstance(record.get('query'), str):
+                raise ValueError("expected a JSON object with a query string")
+            if 'id' in record and not _valid_id(record['id']):
+                raise ValueError("the id must be a plain file name, it names the checkpoint of the query")
+        except ValueError as e:
+            self._send_json(400, {'error': f"Malformed query: {e}"})
+            return
+
+        events = queue.Queue()
+        self.server.submit(record, events.put)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        connected = True
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            if not connected:
+                continue
+            try:
+                self.wfile.write(json.dumps(event, default=str).encode() + b'\n')
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The query keeps running and still updates the caches, skills and checkpoint
+                connected = False
+
+
+class _AgentServerMixin:
+    """Runs the queries on one event loop thread, next to the warm AgentService."""
+
+    def init_agent(self, service: AgentService, max_queries: int = 8):
+        self.logger = logging.getLogger(__name__)
+        self.service = service
+        self.running = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_queries)
+        self._thread = threading.Thread(target=self._loop.run_forever, name='agent-loop', daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict, emit: Callable[[Optional[Dict]], None]):
+        """Schedules the query on the event loop, every event is passed to emit and None marks the end."""
+        with self._lock:
+            self._count += 1
+            record = {'id': record.get('id', self._count), 'query': record['query']}
+        asyncio.run_coroutine_threadsafe(self._run(record, emit), self._loop)
+
+    async def _run(self, record: Dict, emit: Callable[[Optional[Dict]], None]):
+        try:
+            emit({'event': 'queued', 'id': record['id'], 'query': record['query']})
+            async with self._semaphore:
+                with self._lock:
+                    self.running += 1
+                try:
+                    with tracer.span('query', query_id=record['id']):
+                        executor = self.service.executor_for(record, progress=emit)
+                        result = await arun_query(self.service.planner, executor, record)
+                finally:
+                    with self._lock:
+                        self.running -= 1
+            self.logger.info(f"Query {record['id']} finished with status {result['status']} "
+                             f"in {result['elapsed']:.2f}s")
+            emit({'event': 'result', **result})
+        except Exception as e:
+            self.logger.exception(f"Query {record['id']} failed")
+            emit({'event': 'result', 'id': record['id'], 'query': record['query'], 'status': 'error',
+                  'error': f"{type(e).__name__}: {e}"})
+        finally:
+            emit(None)
+
+    def server_close(self):
+        super().server_close()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+
+class AgentHTTPServer(_AgentServerMixin, ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service: AgentService, host: str = '127.0.0.1', port: int = 8765, max_queries: int = 8):
+        super().__init__((host, port), AgentRequestHandler)
+        self.init_agent(service, max_queries)
+
+
+class AgentUnixServer(_AgentServerMixin, socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, service: AgentService, socket_path: str = '.cache/agent.sock', max_queries: int = 8):
+        os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, AgentRequestHandler)
+        self.socket_path = socket_path
+        self.init_agent(service, max_queries)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def serve(service: AgentService, socket_path: str = '.cache/agent.sock', port: Optional[int] = None,
+          max_queries: int = 8):
+    """Serves queries until POST /shutdown or Ctrl-C, over TCP when a port is given and the Unix socket otherwise."""
+    if port is not None:
+        server = AgentHTTPServer(service, port=port, max_queries=max_queries)
+        address = f"http://127.0.0.1:{server.server_address[1]}"
+    else:
+        server = AgentUnixServer(service, socket_path=socket_path, max_queries=max_queries)
+        address = socket_path
+
+    logging.info(f"Agent server listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info("Agent server stopped")
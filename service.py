@@ -0,0 +1,115 @@
+import logging
+import os
+from typing import Callable, Dict, Optional
+
+from action import TaskExecutor
+from skill_library_json import SkillLibrary
+from taskplanner import TaskPlanner
+from utils.cache import ChatCache
+from utils.checkpoint import PlanCheckpoint
+from utils.config import models
+from utils.error_index import ErrorSignatureIndex
+from utils.llm import LLMClient
+from utils.plan_cache import PlanCache
+from utils.retry import RetryPolicy
+from utils.sandbox import ExecutionPool
+from utils.scheduler import ModelScheduler
+from utils.tracing import tracer
+
+
+class AgentService:
+    """
+    The warm state of the pipeline, built once and shared by every query
+        1. One LLM client, execution pool, planner, skill library and reflection / plan indexes
+        2. make_executor() gives every query its own TaskExecutor on top of them
+    main.py builds it for a single run, server.py keeps it loaded between queries.
+    """
+
+    def __init__(self, client: LLMClient, execution_pool: ExecutionPool, planner: TaskPlanner,
+                 cache: ChatCache = None, plan_cache: PlanCache = None, error_index: ErrorSignatureIndex = None,
+                 skill_library: SkillLibrary = None, retry_policy: RetryPolicy = None, stream: bool = False,
+                 num_candidates: int = 1, checkpoint_dir: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.execution_pool = execution_pool
+        self.planner = planner
+        self.cache = cache
+        self.plan_cache = plan_cache
+        self.error_index = error_index
+        self.skill_library = skill_library
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.stream = stream
+        self.num_candidates = num_candidates
+        self.checkpoint_dir = checkpoint_dir
+
+    @classmethod
+    def from_args(cls, args) -> 'AgentService':
+        cache = None if args.no_cache else ChatCache(cache_dir=args.cache_dir)
+        client = LLMClient(host=args.host, default_concurrency=args.concurrency, cache=cache,
+                           max_in_flight=args.llm_concurrency,
+                           scheduler=None if args.no_affinity else ModelScheduler())
+        plan_cache = PlanCache(args.plan_cache, client=client, threshold=args.plan_threshold) \
+            if args.plan_cache else None
+        planner = TaskPlanner(models.planner, client=client, stream=args.stream, plan_cache=plan_cache,
+                              adapt_cached_plans=not args.no_adapt_plans)
+        retry_policy = RetryPolicy(max_retries=args.max_retries, task_deadline=args.task_deadline,
+                                   plan_deadline=args.plan_deadline, task_token_budget=args.task_tokens,
+                                   plan_token_budget=args.plan_tokens, escalate_after=args.escalate_after,
+                                   replan_after=args.replan_after)
+        skill_library = None
+        if args.skills:
+            skill_library = SkillLibrary(args.skills, client=client)
+            skill_library.load_skill_json()
+
+        return cls(client, ExecutionPool(size=args.exec_workers), planner, cache=cache, plan_cache=plan_cache,
+                   error_index=ErrorSignatureIndex(args.reflection_index) if args.reflection_index else None,
+                   skill_library=skill_library, retry_policy=retry_policy, stream=args.stream,
+                   num_candidates=args.candidates, checkpoint_dir=args.checkpoint_dir)
+
+    def make_executor(self, checkpoint: PlanCheckpoint = None,
+                      progress: Callable[[Dict], None] = None) -> TaskExecutor:
+        return TaskExecutor(client=self.client, execution_pool=self.execution_pool, stream=self.stream,
+                            num_candidates=self.num_candidates, skill_library=self.skill_library,
+                            error_index=self.error_index, checkpoint=checkpoint, retry_policy=self.retry_policy,
+                            planner=self.planner, progress=progress)
+
+    def executor_for(self, record: Dict, progress: Callable[[Dict], None] = None) -> TaskExecutor:
+        """Executor of one query record, checkpointed under checkpoint_dir by the record id when it is set."""
+        if not self.checkpoint_dir:
+            return self.make_executor(progress=progress)
+        name = f"{record['id']}.jsonl"
+        if os.path.basename(name) != name:
+            raise ValueError(f"Query id {record['id']!r} is not a plain file name")
+        checkpoint = PlanCheckpoint(os.path.join(self.checkpoint_dir, name))
+        return self.make_executor(checkpoint, progress=progress)
+
+    def stats(self) -> Dict:
+        stats = {'time_per_stage': tracer.summary()}
+        if self.cache is not None:
+            stats['chat_cache'] = self.cache.stats()
+        if self.plan_cache is not None:
+            stats['plan_cache'] = self.plan_cache.stats()
+        if self.error_index is not None:
+            stats['reflection_index'] = self.error_index.stats()
+        if self.client.scheduler is not None:
+            stats['model_scheduler'] = self.client.scheduler.stats()
+        if self.skill_library is not None:
+            stats['skills'] = len(self.skill_library.skills)
+        stats['prompt_prefix'] = self.client.prefixes.stats()
+        return stats
+
+    def log_stats(self):
+        stats = self.stats()
+        for name, label in (('chat_cache', "Chat cache"), ('plan_cache', "Plan cache"),
+                            ('reflection_index', "Reflection index"), ('model_scheduler', "Model scheduler"),
+                            ('prompt_prefix', "Prompt prefix reuse")):
+            if name in stats:
+                self.logger.info(f"{label}: {stats[name]}")
+        self.logger.info(f"Time per stage: {stats['time_per_stage']}")
+
+    def close(self):
+        self.execution_pool.close()
+        if self.plan_cache is not None:
+            self.plan_cache.close()
+        if self.skill_library is not None and self.skill_library.store is not None:
+            self.skill_library.store.close()
@@ -1,8 +1,18 @@
+import ast
 import json
 import logging
-from typing import List, Dict
+import os
+import threading
+from dataclasses import asdict
+from datetime import datetime
+from typing import List, Dict, Optional
 from utils.model import Skill, Task
-from v3.utils.model import Skill
+from utils.config import models
+from utils.llm import LLMClient, get_default_client
+from utils.skill_dedup import (SkillDeduplicator, add_alias, aliases, best_variant, merge_skills, rewrite_dependencies,
+                               same_code, skill_key)
+from utils.skill_index import SkillIndex
+from utils.skill_store import SkillStore
 
 """
 Since the number of tasks will be exponential, it will be better to group them into tasks.
@@ -10,30 +20,345 @@ Since the number of tasks will be exponential, it will be better to group them i
 
 
 class SkillLibrary:
+    """
+    Skill Library backed by a JSON file, or by a SkillStore when the path ends in .db / .sqlite
+        1. Skill embeddings are kept in a local SkillIndex persisted next to the JSON file
+        2. find_matching_skill searches the index without any external service
+        3. lookup_skill returns a skill safe to reuse: an exact (name, description) match or a match above reuse_score
+        4. With a SkillStore only the metadata is loaded, code bodies are read on first use and writes are in place
+        5. A new skill with the same normalised code as a stored one is folded into it, compact() merges the
+           near-duplicates already stored. Only variants with the same normalised code keep their (name, description)
+           as an alias for the exact lookup
+    """
     skills: list[Skill]
 
-    def __init__(self, skill_json: str):
+    def __init__(self, skill_json: str, client: LLMClient = None, embedding_model: str = models.embedding,
+                 min_score: float = 0.85, reuse_score: float = 0.95, deduplicate: bool = True,
+                 dedup_threshold: float = 0.8, dedup_embedding_threshold: float = 0.85):
         self.skill_json = skill_json
         self.logger = logging.getLogger(__name__)
+        self.client = client or get_default_client()
+        self.embedding_model = embedding_model
+        self.min_score = min_score
+        self.reuse_score = reuse_score
+        self.skills = []
+        self.index = SkillIndex()
+        self._exact: Dict[str, Skill] = {}
+        self.deduplicate = deduplicate
+        self.dedup = SkillDeduplicator(code_threshold=dedup_threshold, embedding_threshold=dedup_embedding_threshold)
+        self._dedup_ready = False
+        self._lock = threading.RLock()
+        self.store = SkillStore(skill_json) if skill_json.endswith(('.db', '.sqlite', '.sqlite3')) else None
+
+    @property
+    def index_prefix(self) -> str:
+        return f"{os.path.splitext(self.skill_json)[0]}.index"
 
     def load_skill_json(self):
+        if self.store is not None:
+            self.skills = self.store.load()
+            self._index_loaded_skills()
+            return self.skills
+
         try:
             with open(self.skill_json, 'r') as f:
                 skills = json.load(f)
-        except FileNotFoundError as e:
-            print(f"Error in loading skill library")
+        except FileNotFoundError:
+            self.logger.info(f"No skill library at {self.skill_json}, starting an empty one")
+            skills = []
+
+        self.load_skills(skills)
+        self._index_loaded_skills()
+        return self.skills
+
+    def _index_loaded_skills(self):
+        self._exact = {}
+        for skill in self.skills:
+            self._add_exact(skill)
+        self.load_index()
+        self._dedup_ready = False
+
+    def import_json(self, skill_json: str) -> int:
+        """Copies the skills of a JSON skill library into the store in one transaction."""
+        if self.store is None:
+            raise ValueError("import_json needs a SkillLibrary backed by a SkillStore")
+
+        with open(skill_json, 'r') as f:
+            library = SkillLibrary(skill_json, client=self.client)
+            library.load_skills(json.load(f))
+        count = self.store.extend(library.skills)
+        self.load_skill_json()
+        return count
 
     def load_skills(self, skills):
         self.skills = [
-            Skill(name=skill.name,
-                  description=skill.description,
-                  code=skill.code,
-                  package_dependencies=skill.package_dependencies,
-                  function_dependencies=skill.function_dependencies,
-                  created_at=skill.created_at,
-                  success_count=skill.code,
-                  failure_count=skill.failure_count,
-                  average_execution_time=skill.average_execution_time) for skill in skills]
-
-    def find_matching_skill(self, task: Task) -> Skill:
-        pass
\ No newline at end of file
+            Skill(name=skill['name'],
+                  description=skill['description'],
+                  code=skill['code'],
+                  package_dependencies=skill.get('package_dependencies') or [],
+                  function_dependencies=skill.get('function_dependencies') or [],
+                  created_at=datetime.fromisoformat(skill['created_at'])
+                  if isinstance(skill.get('created_at'), str) else skill.get('created_at'),
+                  success_count=skill.get('success_count', 0),
+                  failure_count=skill.get('failure_count', 0),
+                  average_execution_time=skill.get('average_execution_time', 0.0),
+                  tags=skill.get('tags')) for skill in skills]
+
+    @staticmethod
+    def _skill_text(name: str, description: str) -> str:
+        return f"{name}: {description}"
+
+    def _embed(self, texts: List[str]):
+        return self.client.embed(self.embedding_model, texts)
+
+    def load_index(self):
+        """Memory-maps the persisted index, rebuilding it when it is missing or out of date."""
+        index = SkillIndex.load(self.index_prefix)
+        if index is not None and index.names == [skill.name for skill in self.skills]:
+            self.index = index
+            return
+
+        self.index = SkillIndex()
+        if self.skills:
+            try:
+                embeddings = self._embed([self._skill_text(skill.name, skill.description) for skill in self.skills])
+            except Exception as e:
+                self.logger.warning(f"Could not build the skill index, only exact matches are reused: {e}")
+                return
+            self.index.add([skill.name for skill in self.skills], embeddings)
+            self.index.save(self.index_prefix)
+            self.logger.info(f"Skill index rebuilt with {len(self.index)} skills")
+
+    def save(self):
+        if self.store is not None:
+            return
+
+        with self._lock:
+            skills = [asdict(skill) for skill in self.skills]
+            tmp_path = f"{self.skill_json}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(skills, f, indent=2, default=str)
+            os.replace(tmp_path, self.skill_json)
+
+    def _matches(self, embeddings, k: int, min_score: Optional[float]) -> List[List[Skill]]:
+        min_score = self.min_score if min_score is None else min_score
+        skills_by_name = {skill.name: skill for skill in self.skills}
+        return [[skills_by_name[name] for name, score in task_matches if score >= min_score]
+                for task_matches in self.index.search(embeddings, k)]
+
+    def find_matching_skills(self, tasks: List[Task], k: int = 1, min_score: float = None) -> List[List[Skill]]:
+        if not len(self.index):
+            return [[] for _ in tasks]
+        return self._matches(self._embed([self._skill_text(task.name, task.description) for task in tasks]), k,
+                             min_score)
+
+    def find_matching_skill(self, task: Task, min_score: float = None) -> Optional[Skill]:
+        matches = self.find_matching_skills([task], min_score=min_score)[0]
+        return matches[0] if matches else None
+
+    def _add_exact(self, skill: Skill):
+        self._exact.setdefault(skill_key(skill.name, skill.description), skill)
+        for alias in aliases(skill):
+            self._exact.setdefault(alias, skill)
+
+    def find_exact_skill(self, task: Task) -> Optional[Skill]:
+        return self._exact.get(skill_key(task.name, task.description))
+
+    def lookup_skill(self, task: Task) -> Optional[Skill]:
+        skill = self.find_exact_skill(task)
+        if skill is not None:
+            return skill
+
+        try:
+            return self.find_matching_skill(task, min_score=self.reuse_score)
+        except Exception as e:
+            self.logger.warning(f"Semantic skill lookup failed: {e}")
+            return None
+
+    async def alookup_skill(self, task: Task) -> Optional[Skill]:
+        """lookup_skill for the event loop, the task is embedded with the async client."""
+        skill = self.find_exact_skill(task)
+        if skill is not None or not len(self.index):
+            return skill
+
+        try:
+            embeddings = await self.client.aembed(self.embedding_model, [self._skill_text(task.name, task.description)])
+            matches = self._matches(embeddings, 1, self.reuse_score)[0]
+        except Exception as e:
+            self.logger.warning(f"Semantic skill lookup failed: {e}")
+            return None
+        return matches[0] if matches else None
+
+    @staticmethod
+    def package_dependencies(code: str) -> List[str]:
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return []
+
+        packages = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                packages.update(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                packages.add(node.module.split('.')[0])
+        return sorted(packages)
+
+    def _ensure_dedup_index(self):
+        """Signs the code of every skill on first use, with a SkillStore this reads all the code bodies once."""
+        if self._dedup_ready:
+            return
+        for skill in self.skills:
+            self.dedup.add(skill.name, skill.code, self.index.get(skill.name))
+        self._dedup_ready = True
+        self.logger.info(f"Near-duplicate index built over {len(self.dedup)} skills")
+
+    def _embed_skill(self, name: str, description: str):
+        try:
+            return self._embed([self._skill_text(name, description)])[0]
+        except Exception as e:
+            self.logger.warning(f"Could not embed skill {name}: {e}")
+            return None
+
+    def _fold_duplicate(self, task: Task, code: str, embedding, execution_time: float) -> Optional[Skill]:
+        """
+        Counts the execution for a stored skill with the same normalised code, keeping the task as its alias.
+        A near-duplicate whose code differs, e.g. only in its strings, is stored as a variant of its own.
+        """
+        self._ensure_dedup_index()
+        match = self.dedup.find(code, embedding)
+        if match is None:
+            return None
+
+        duplicate = next(skill for skill in self.skills if skill.name == match[0])
+        if not same_code(code, duplicate.code):
+            self.logger.info(f"Skill {task.name} is a near-duplicate of {duplicate.name} "
+                             f"(similarity {match[1]:.2f}), stored as a variant")
+            return None
+        self.logger.info(f"Skill {task.name} duplicates {duplicate.name} (similarity {match[1]:.2f}), merged")
+        if add_alias(duplicate, skill_key(task.name, task.description)):
+            self._add_exact(duplicate)
+            if self.store is not None:
+                self.store.update_metadata([duplicate])
+        self.record_execution(duplicate, True, execution_time)
+        return duplicate
+
+    def _free_name(self, name: str) -> str:
+        """The name, numbered when a stored skill already has it, the index and dedup are keyed by skill name."""
+        taken = {skill.name for skill in self.skills}
+        number = 2
+        unique = name
+        while unique in taken:
+            unique = f"{name}_{number}"
+            number += 1
+        return unique
+
+    def add_skill(self, task: Task, code: str, execution_time: float) -> Skill:
+        """
+        Stores the code of a successfully executed task
+            1. The code of a skill with the same name and description is replaced
+            2. Code nearly duplicating a stored skill only updates the counters of that skill
+            3. A skill whose name is taken by a different description is stored under a numbered name, the task
+               name and description stay as its alias for the exact lookup
+        """
+        with self._lock:
+            key = skill_key(task.name, task.description)
+            existing = next((skill for skill in self.skills if skill_key(skill.name, skill.description) == key), None)
+            if existing is not None:
+                existing.code = code
+                existing.package_dependencies = self.package_dependencies(code)
+                if self.store is not None:
+                    self.store.update_code(existing)
+                if self._dedup_ready:
+                    self.dedup.add(existing.name, code, self.index.get(existing.name))
+                self.record_execution(existing, True, execution_time)
+                return existing
+
+            embedding = self._embed_skill(task.name, task.description)
+            if self.deduplicate:
+                duplicate = self._fold_duplicate(task, code, embedding, execution_time)
+                if duplicate is not None:
+                    return duplicate
+
+            skill = Skill(name=self._free_name(task.name),
+                          description=task.description,
+                          code=code,
+                          package_dependencies=self.package_dependencies(code),
+                          function_dependencies=[],
+                          created_at=datetime.now(),
+                          success_count=1,
+                          average_execution_time=execution_time)
+            add_alias(skill, key)
+            if self.store is not None:
+                skill = self.store.append(skill)
+            self.skills.append(skill)
+            self._add_exact(skill)
+
+            if embedding is not None:
+                self.index.add([skill.name], [embedding])
+                self.index.save(self.index_prefix)
+            if self._dedup_ready:
+                self.dedup.add(skill.name, code, embedding)
+
+            self.save()
+            return skill
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Merges every group of near-duplicate skills into its best variant
+            1. The variant with the most successes wins, the fastest one on a tie
+            2. Counters are summed, the names of the merged variants become aliases of the winner
+            3. function_dependencies on a merged variant are pointed at the winner
+        """
+        with self._lock:
+            self._ensure_dedup_index()
+            skills_by_name = {skill.name: skill for skill in self.skills}
+            renames, removed, keepers = {}, [], []
+            for cluster in self.dedup.clusters():
+                group = [skills_by_name[name] for name in cluster]
+                keeper = best_variant(group)
+                duplicates = [skill for skill in group if skill is not keeper]
+                merge_skills(keeper, duplicates)
+                renames.update({skill.name: keeper.name for skill in duplicates})
+                removed.extend(duplicates)
+                keepers.append(keeper)
+
+            stats = {'skills': len(self.skills), 'merged': len(removed), 'groups': len(keepers)}
+            if not removed:
+                return stats
+
+            self.skills = [skill for skill in self.skills if skill.name not in renames]
+            changed = rewrite_dependencies(self.skills, renames)
+            for skill in removed:
+                self.dedup.remove(skill.name)
+
+            if self.store is not None:
+                self.store.delete(removed)
+                self.store.update_metadata({id(skill): skill for skill in keepers + changed}.values())
+            else:
+                self.save()
+
+            self.index = self.index.subset([skill.name for skill in self.skills])
+            if len(self.index):
+                self.index.save(self.index_prefix)
+            self._exact = {}
+            for skill in self.skills:
+                self._add_exact(skill)
+
+            stats['remaining'] = len(self.skills)
+            self.logger.info(f"Skill library compacted: {stats}")
+            return stats
+
+    def record_execution(self, skill: Skill, success: bool, execution_time: float):
+        with self._lock:
+            if success:
+                skill.average_execution_time = ((skill.average_execution_time * skill.success_count + execution_time)
+                                                / (skill.success_count + 1))
+                skill.success_count += 1
+            else:
+                skill.failure_count += 1
+
+            if self.store is not None:
+                self.store.update_counters(skill)
+            else:
+                self.save()
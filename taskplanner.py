@@ -1,30 +1,19 @@
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from utils.model import Task
+from utils.llm import LLMClient, get_default_client
+from utils.plan_cache import PlanCache, PlanMatch
+from utils.prompts import assemble, static_prompt
+from utils.streaming import IncrementalJSONValidator
+from utils.tracing import tracer
 
 import ast
+import asyncio
+import json
 import ollama
 
 
-class TaskPlanner:
-    def __init__(self, llm_client):
-        self.logger = logging.getLogger(__name__)
-        self.llm_client = llm_client
-        self.tasks = []
-
-    def format_response(self, response) -> Any:
-        llm_response = response['message']['content']
-        self.logger.info(f"Response Generated:\n{llm_response}")
-
-        try:
-            llm_response = ast.literal_eval(llm_response)["Tasks"]
-            return llm_response
-        except Exception as e:
-            return llm_response
-
-    def generate_plan(self, query) -> Any:
-        messages = []
-        admin_prompt = f"""
+_PLANNER_PROMPT = static_prompt("""
             You are an Advanced Technical Assistant that prepares a curriculum of tasks to help achieve user-defined goals in a structured and technical manner. 
             The curriculum should be designed with Python programming in mind, utilizing existing Python packages wherever applicable, instead of suggesting manual scraping or signing up for APIs.
             DO NOT ASK TO SCRAP OR USE API CALLS.
@@ -43,42 +32,214 @@ class TaskPlanner:
 
             You should respond in the following format:
             RESPONSE JSON FORMAT:
-            {{
+            {
                 id: int
                 name: str (function_name)
                 description: str
-            }}
+                dependencies: List[int] (ids of the tasks whose code or output this task needs, [] if none)
+            }
 
             Example:
-            {{
+            {
                 "Tasks": [
-                    {{
+                    {
                         id: int
                         name: str
                         description: str
-                    }},
-                    {{
+                        dependencies: List[int]
+                    },
+                    {
                         id: int
                         name: str
                         description: str
-                    }},
-                    {{
+                        dependencies: List[int]
+                    },
+                    {
                         id: int
                         name: str
                         description: str
-                    }}
+                        dependencies: List[int]
+                    }
                 ]
-            }}
+            }
 
+            Only list a dependency when the task really needs it, independent tasks are executed in parallel.
             Ensure the response can be parsed by Python's `json.loads` without errors.
-            """
+""")
+
+
+class TaskPlanner:
+    def __init__(self, llm_client, client: LLMClient = None, stream: bool = False, plan_cache: PlanCache = None,
+                 adapt_cached_plans: bool = True):
+        self.logger = logging.getLogger(__name__)
+        self.llm_client = llm_client
+        self.client = client or get_default_client()
+        self.stream = stream
+        self.plan_cache = plan_cache
+        self.adapt_cached_plans = adapt_cached_plans
+        self.tasks = []
+
+    def format_response(self, response) -> Any:
+        llm_response = response['message']['content']
+        self.logger.info(f"Response Generated:\n{llm_response}")
+
+        try:
+            llm_response = ast.literal_eval(llm_response)["Tasks"]
+            return llm_response
+        except Exception as e:
+            return llm_response
 
+    @staticmethod
+    def _build_messages(query) -> List[ollama.Message]:
+        return assemble(_PLANNER_PROMPT, ('user', f'Question: {query}'))
+
+    def _tasks_validator(self):
+        return IncrementalJSONValidator('Tasks', 'array',
+                                        on_item=lambda task: self.logger.info(f"Task planned: {task}"))
+
+    @staticmethod
+    def _valid_plan(tasks) -> bool:
+        return (isinstance(tasks, list) and bool(tasks) and
+                all(isinstance(task, dict) and {'id', 'name', 'description'} <= task.keys() for task in tasks))
+
+    @staticmethod
+    def _build_adapt_messages(query, match: PlanMatch) -> List[ollama.Message]:
+        return [
+            ollama.Message(role='system', content="You adjust an existing curriculum of Python programming tasks to "
+                                                  "a new, similar goal. Keep the tasks that still apply, rename or "
+                                                  "reword the ones that do not. Respond in the same JSON format: "
+                                                  "{\"Tasks\": [{\"id\", \"name\", \"description\", "
+                                                  "\"dependencies\"}]}"),
+            ollama.Message(role='user', content=f"Previous goal: {match.query}\n"
+                                                f"Previous curriculum: {json.dumps({'Tasks': match.tasks})}\n"
+                                                f"New goal: {query}"),
+        ]
+
+    def _needs_adapting(self, match: PlanMatch) -> bool:
+        return self.adapt_cached_plans and match.score < 0.999
+
+    def _use_cached_plan(self, query, match: PlanMatch, adapted=None) -> Tuple[Any, Optional[str]]:
+        self.logger.info(f"Reusing the plan of {match.query!r} (similarity {match.score:.3f}) for {query!r}")
+        if adapted is not None and self._valid_plan(adapted):
+            return adapted, self.plan_cache.put(query, adapted)
+
+        if adapted is not None:
+            self.logger.warning("Adapted plan was malformed, using the cached plan unchanged")
+        return match.tasks, match.key
+
+    def _store_plan(self, query, tasks) -> Optional[str]:
+        if self.plan_cache is not None and self._valid_plan(tasks):
+            return self.plan_cache.put(query, tasks)
+        return None
+
+    def generate_plan(self, query) -> Tuple[Any, Optional[str]]:
+        """
+        The tasks of the query and the plan cache key of the plan, None when it is not cached.
+        The key is handed back to record_outcome, the planner keeps no state per query so it can be shared.
+        """
+        with tracer.span('plan', model=self.llm_client) as span:
+            match = self.plan_cache.lookup(query) if self.plan_cache is not None else None
+            span.set(cache_hit=match is not None)
+
+            if match is not None:
+                adapted = None
+                if self._needs_adapting(match):
+                    adapted = self.format_response(self.client.chat(model=self.llm_client, format='json',
+                                                                    messages=self._build_adapt_messages(query, match)))
+                tasks, key = self._use_cached_plan(query, match, adapted)
+            else:
+                tasks = self._generate_plan(query)
+                key = self._store_plan(query, tasks)
+
+            span.set(tasks=len(tasks) if isinstance(tasks, list) else None)
+            return tasks, key
+
+    async def agenerate_plan(self, query) -> Tuple[Any, Optional[str]]:
+        with tracer.span('plan', model=self.llm_client) as span:
+            match = await self.plan_cache.alookup(query) if self.plan_cache is not None else None
+            span.set(cache_hit=match is not None)
+
+            if match is not None:
+                adapted = None
+                if self._needs_adapting(match):
+                    adapted = self.format_response(await self.client.achat(
+                        model=self.llm_client, format='json', messages=self._build_adapt_messages(query, match)))
+                tasks, key = await asyncio.to_thread(self._use_cached_plan, query, match, adapted)
+            else:
+                tasks = await self._agenerate_plan(query)
+                key = await asyncio.to_thread(self._store_plan, query, tasks)
+
+            span.set(tasks=len(tasks) if isinstance(tasks, list) else None)
+            return tasks, key
+
+    def record_outcome(self, key: Optional[str], tasks: List[Task]):
+        """Drops the cached plan returned with the tasks by generate_plan when any of them did not complete."""
+        if key is not None and any(task.status != 'completed' for task in tasks):
+            self.plan_cache.invalidate(key)
+
+    @staticmethod
+    def _build_replan_messages(task: Task, error: str) -> List[ollama.Message]:
+        return [
+            ollama.Message(role='system', content="A task of a Python programming curriculum keeps failing. Rewrite "
+                                                  "it so that it reaches the same goal in a simpler or different way, "
+                                                  "e.g. with another package or without network access. Respond "
+                                                  "only with JSON: {\"name\": \"\", \"description\": \"\"}"),
+            ollama.Message(role='user', content=f"Goal: {task.task_tracker['original_query']}\n"
+                                                f"Task: {task.name}: {task.description}\n"
+                                                f"Last error: {error}"),
+        ]
+
+    def _apply_replan(self, task: Task, response) -> bool:
+        try:
+            rewritten = json.loads(response['message']['content'])
+            name, description = str(rewritten['name']).strip(), str(rewritten['description']).strip()
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.warning(f"Could not rewrite task {task.name}: {e}")
+            return False
+
+        if not name or not description:
+            return False
+        self.logger.info(f"Task {task.name} rewritten as {name}: {description}")
+        task.name, task.description = name, description
+        return True
+
+    def replan_task(self, task: Task, error: str) -> bool:
+        """Asks the planner to rewrite a failing task in place, the id and dependencies are kept."""
+        with tracer.span('replan', model=self.llm_client, task=task.name):
+            response = self.client.chat(model=self.llm_client, format='json',
+                                        messages=self._build_replan_messages(task, error))
+        return self._apply_replan(task, response)
+
+    async def areplan_task(self, task: Task, error: str) -> bool:
+        with tracer.span('replan', model=self.llm_client, task=task.name):
+            response = await self.client.achat(model=self.llm_client, format='json',
+                                               messages=self._build_replan_messages(task, error))
+        return self._apply_replan(task, response)
+
+    def _generate_plan(self, query) -> Any:
         self.logger.info(f"Executing {query}")
 
-        messages.append(ollama.Message(role='system', content=admin_prompt))
-        messages.append(ollama.Message(role='user', content=f'Question: {query}'))
+        if self.stream:
+            response = self.client.chat_stream(self.llm_client, self._build_messages(query),
+                                               validator=self._tasks_validator)
+        else:
+            response = self.client.chat(model=self.llm_client, messages=self._build_messages(query), format='json')
 
-        response = ollama.chat(model=self.llm_client, messages=messages, format='json')
+        tasks = self.format_response(response)
+
+        self.logger.info(f"Planning for {query} completed.")
+
+        return tasks
+
+    async def _agenerate_plan(self, query) -> Any:
+        self.logger.info(f"Executing {query}")
+
+        if self.stream:
+            response = await self.client.achat_stream(self.llm_client, self._build_messages(query),
+                                                      validator=self._tasks_validator)
+        else:
+            response = await self.client.achat(model=self.llm_client, messages=self._build_messages(query),
+                                               format='json')
 
         tasks = self.format_response(response)
 
@@ -86,12 +247,15 @@ class TaskPlanner:
 
         return tasks
 
-    def make_tasks_list(self, tasks) -> List[Task]:
+    def make_tasks_list(self, tasks, query: str = '') -> List[Task]:
         self.tasks = [
             Task(id=int(task_data['id']),
                  name=task_data['name'],
-                 description=task_data['description'])
+                 description=task_data['description'],
+                 dependencies=[int(dep) for dep in task_data.get('dependencies') or []])
             for task_data in tasks]
+        for task in self.tasks:
+            task.task_tracker['original_query'] = query
 
         self.logger.info(f"Tasks Generated: \n{self.tasks}")
         return self.tasks
@@ -109,6 +273,6 @@ if __name__ == "__main__":
 
     plans = TaskPlanner("mistral-nemo")
 
-    tasks = plans.generate_plan("Get the stock price of Microsoft till now.")
+    tasks, _ = plans.generate_plan("Get the stock price of Microsoft till now.")
 
     plans.make_tasks_list(tasks)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def to_dict(obj) -> Any:
+    """Converts ollama messages / responses (pydantic models or mappings) to plain JSON-able dicts."""
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump(mode='json', exclude_none=True)
+    if isinstance(obj, dict):
+        return {key: to_dict(value) for key, value in obj.items() if value is not None}
+    if isinstance(obj, (list, tuple)):
+        return [to_dict(value) for value in obj]
+    return obj
+
+
+def chat_key(model: str, messages: List, format: Any = None, options: Optional[Dict] = None) -> str:
+    payload = json.dumps({"model": model,
+                          "messages": to_dict(messages),
+                          "format": format,
+                          "options": to_dict(options) if options else None},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ChatCache:
+    """
+    Content-addressed cache of chat completions
+        1. In-memory LRU tier holding the most recent max_entries responses
+        2. On-disk tier, one JSON file per key, bounded by max_bytes and max_age seconds
+        3. Counters for memory hits, disk hits and misses
+    """
+
+    def __init__(self, cache_dir: Optional[str] = '.cache/chat', max_entries: int = 512,
+                 max_bytes: int = 256 * 1024 * 1024, max_age: Optional[float] = 7 * 24 * 3600):
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.memory: OrderedDict[str, Dict] = OrderedDict()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _disk_entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _expired(self, created_at: float) -> bool:
+        return self.max_age is not None and time.time() - created_at > self.max_age
+
+    def _remember(self, key: str, entry: Dict):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _remove_file(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._disk_bytes -= size
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is not None and not self._expired(entry['created_at']):
+                self.memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return entry['response']
+            self.memory.pop(key, None)
+
+            if self.cache_dir:
+                path = self._path(key)
+                try:
+                    with open(path, 'r') as f:
+                        entry = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    entry = None
+
+                if entry is not None:
+                    if self._expired(entry['created_at']):
+                        self._remove_file(path)
+                    else:
+                        os.utime(path)
+                        self._remember(key, entry)
+                        self.hits['disk'] += 1
+                        return entry['response']
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response) -> Dict:
+        entry = {'created_at': time.time(), 'response': to_dict(response)}
+
+        with self._lock:
+            self._remember(key, entry)
+
+            if self.cache_dir:
+                path = self._path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._remove_file(path)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+                self._disk_bytes += os.path.getsize(path)
+
+                if self._disk_bytes > self.max_bytes:
+                    self._evict()
+
+        return entry['response']
+
+    def _evict(self):
+        """Drops expired files, then the least recently used ones until the disk tier is 90% of max_bytes."""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        for path, _, mtime in entries:
+            if self._disk_bytes <= self.max_bytes * 0.9 and not self._expired(mtime):
+                break
+            self._remove_file(path)
+
+    def clear(self):
+        with self._lock:
+            self.memory.clear()
+            if self.cache_dir:
+                for path, _, _ in list(self._disk_entries()):
+                    self._remove_file(path)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits['memory'] + self.hits['disk'] + self.misses
+        return {'memory_hits': self.hits['memory'],
+                'disk_hits': self.hits['disk'],
+                'misses': self.misses,
+                'hit_ratio': (lookups - self.misses) / lookups if lookups else 0.0,
+                'memory_entries': len(self.memory),
+                'disk_bytes': self._disk_bytes}
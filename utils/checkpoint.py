@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.model import ExecutionResult, Task
+
+
+class PlanCheckpoint:
+    """
+    Append-only JSONL log of one plan execution
+        1. start() writes the query and the task list
+        2. record_feedback() is written after every failed attempt, record_task() when a task finishes
+        3. Opening an existing log replays it, the last record of a task wins and a torn last line is ignored
+        4. restore_tasks() rebuilds the task list with the status, retry count and feedback of every task
+    Every record is flushed and fsynced, so the log survives a crash of the process.
+    """
+
+    def __init__(self, path: str):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.query: Optional[str] = None
+        self.tasks: List[Dict] = []
+        self.finished: Dict[int, Dict] = {}
+        self.feedbacks: Dict[int, List[str]] = {}
+        self.retry_counts: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            self._replay()
+
+    def _replay(self):
+        with open(self.path, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    self.logger.warning(f"Ignoring unreadable line {line_number} of {self.path}")
+                    continue
+                self._apply(record)
+
+    def _apply(self, record: Dict):
+        if record['type'] == 'plan':
+            self.query = record['query']
+            self.tasks = record['tasks']
+            self.finished, self.feedbacks, self.retry_counts = {}, {}, {}
+        elif record['type'] == 'feedback':
+            self.feedbacks.setdefault(record['id'], []).append(record['feedback'])
+            self.retry_counts[record['id']] = record['retry_count']
+        elif record['type'] == 'task':
+            self.finished[record['id']] = record
+            self.retry_counts[record['id']] = record['retry_count']
+
+    def _write(self, record: Dict):
+        record['time'] = time.time()
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(record)
+
+    @property
+    def started(self) -> bool:
+        return bool(self.tasks)
+
+    def start(self, query: str, tasks: List[Task]):
+        self._write({'type': 'plan',
+                     'query': query,
+                     'tasks': [{'id': task.id, 'name': task.name, 'description': task.description,
+                                'dependencies': task.dependencies, 'max_retries': task.max_retries}
+                               for task in tasks]})
+
+    def record_feedback(self, task: Task, feedback: str):
+        self._write({'type': 'feedback', 'id': task.id, 'retry_count': task.retry_count, 'feedback': feedback})
+
+    def record_task(self, task: Task, result: ExecutionResult, execution_time: float):
+        self._write({'type': 'task',
+                     'id': task.id,
+                     'status': result.status,
+                     'code': result.output,
+                     'stdout': result.stdout,
+                     'error': result.error,
+                     'retry_count': task.retry_count,
+                     'execution_time': execution_time})
+
+    def completed(self, task_id: int) -> Optional[Dict]:
+        record = self.finished.get(task_id)
+        return record if record is not None and record['status'] == 'success' else None
+
+    def restore_tasks(self) -> List[Task]:
+        tasks = []
+        for data in self.tasks:
+            task = Task(id=data['id'], name=data['name'], description=data['description'],
+                        dependencies=list(data.get('dependencies') or []),
+                        max_retries=data.get('max_retries', 3),
+                        retry_count=self.retry_counts.get(data['id'], 0))
+            task.status = 'completed' if self.completed(task.id) else 'pending'
+            task.task_feedbacks = list(self.feedbacks.get(task.id, []))
+            task.task_tracker['original_query'] = self.query
+            tasks.append(task)
+
+        done = sum(task.status == 'completed' for task in tasks)
+        self.logger.info(f"Resuming {self.query!r} from {self.path}: {done} of {len(tasks)} tasks already completed")
+        return tasks
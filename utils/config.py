@@ -0,0 +1,25 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Union
+
+
+@dataclass
+class ModelConfig:
+    """
+    The models used by every stage of the pipeline, in one place
+        1. planner / coder / reflection / embedding name the model of each stage, escalation is the larger
+           code model used for tasks that keep failing
+        2. keep_alive is the Ollama keep-alive hint sent with every request, overridable per model
+    """
+    planner: str = 'mistral-nemo'
+    coder: str = 'qwen2.5-coder:7b-instruct-q6_K'
+    escalation: Optional[str] = 'qwen2.5-coder:14b-instruct-q4_K_M'
+    reflection: str = 'mistral-nemo'
+    embedding: str = 'nomic-embed-text'
+    keep_alive: Union[str, float, None] = '30m'
+    keep_alive_overrides: Dict[str, Union[str, float]] = field(default_factory=dict)
+
+    def keep_alive_for(self, model: str) -> Optional[Union[str, float]]:
+        return self.keep_alive_overrides.get(model, self.keep_alive)
+
+
+models = ModelConfig()
@@ -0,0 +1,98 @@
+import ast
+import threading
+from typing import List, Optional
+
+from utils.model import Task
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count, ~4 characters per token for code and English."""
+    return (len(text) + 3) // 4
+
+
+def _signature(node) -> str:
+    prefix = 'async def' if isinstance(node, ast.AsyncFunctionDef) else 'def'
+    signature = f"{prefix} {node.name}({ast.unparse(node.args)})"
+    if node.returns is not None:
+        signature += f" -> {ast.unparse(node.returns)}"
+    return signature
+
+
+def _docstring(node) -> str:
+    docstring = ast.get_docstring(node)
+    return f"  # {docstring.strip().splitlines()[0]}" if docstring else ''
+
+
+def summarize_code(code: str) -> List[str]:
+    """Signatures and first docstring lines of the top-level functions and classes defined by the code."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+
+    lines = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            lines.append(_signature(node) + _docstring(node))
+        elif isinstance(node, ast.ClassDef):
+            bases = f"({', '.join(ast.unparse(base) for base in node.bases)})" if node.bases else ''
+            lines.append(f"class {node.name}{bases}" + _docstring(node))
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) and \
+                        (not child.name.startswith('_') or child.name == '__init__'):
+                    lines.append(f"    {_signature(child)}" + _docstring(child))
+    return lines
+
+
+class TaskContext:
+    """
+    Digest of the completed tasks passed to the executor prompt
+        1. Each task is summarised once, when it completes, into its signatures, docstrings and key output
+        2. render() packs the most recent digests into a token budget instead of the full source
+        3. Without include_signatures only the task and its output are kept, e.g. when an ExecutionSession
+           already lists the signatures
+    """
+
+    def __init__(self, token_budget: int = 1024, max_output_chars: int = 200, include_signatures: bool = True):
+        self.token_budget = token_budget
+        self.max_output_chars = max_output_chars
+        self.include_signatures = include_signatures
+        self._digests: List[str] = []
+        self._tokens: List[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._digests)
+
+    def add(self, task: Task, code: str, output: str = ''):
+        lines = [f"Task {task.id} {task.name}: {task.description}"]
+        if self.include_signatures:
+            lines.extend(f"  {line}" for line in summarize_code(code))
+
+        output = (output or '').strip()
+        if output:
+            if len(output) > self.max_output_chars:
+                output = output[:self.max_output_chars] + '...'
+            lines.append(f"  output: {output}")
+
+        digest = '\n'.join(lines)
+        with self._lock:
+            self._digests.append(digest)
+            self._tokens.append(estimate_tokens(digest))
+
+    def render(self, token_budget: Optional[int] = None) -> str:
+        budget = self.token_budget if token_budget is None else min(token_budget, self.token_budget)
+
+        with self._lock:
+            selected = []
+            used = 0
+            for digest, tokens in zip(reversed(self._digests), reversed(self._tokens)):
+                if used + tokens > budget:
+                    break
+                selected.append(digest)
+                used += tokens
+            omitted = len(self._digests) - len(selected)
+
+        if omitted:
+            selected.append(f"({omitted} earlier tasks omitted)")
+        return '\n'.join(reversed(selected))
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+_EXCEPTION_LINE = re.compile(r'^(?:[\w.]+\.)?(\w+(?:Error|Exception|Exit|Interrupt|Warning))(?::\s*(.*))?$')
+_FRAME_LINE = re.compile(r'^\s*File "[^"]*", line \d+(?:, in (\S+))?')
+_SYMBOL_PATTERNS = (
+    re.compile(r"name '([^']+)' is not defined"),
+    re.compile(r"No module named '([^']+)'"),
+    re.compile(r"cannot import name '([^']+)'"),
+    re.compile(r"has no attribute '([^']+)'"),
+    re.compile(r"'([^']+)' object is not (?:callable|subscriptable|iterable)"),
+    re.compile(r"unexpected keyword argument '([^']+)'"),
+    re.compile(r"^'([^']+)'$"),
+)
+
+
+def _normalise_message(message: str, symbol: Optional[str]) -> str:
+    message = re.sub(r'(["\'])(?:(?!\1).)*\1', lambda m: m.group(0) if symbol and m.group(0)[1:-1] == symbol
+                     else "'<str>'", message)
+    message = re.sub(r'0x[0-9a-fA-F]+', '<addr>', message)
+    return re.sub(r'\d+', '<n>', message).strip()
+
+
+def error_signature(error: Optional[str]) -> Optional[str]:
+    """
+    Normalises a traceback to a signature shared by failures of the same kind
+        1. The exception type and the offending symbol (undefined name, missing module, attribute, ...)
+        2. The exception message with literals and numbers masked
+        3. The function names of the traceback frames, without paths or line numbers
+    Returns None when no exception line is found.
+    """
+    if not error:
+        return None
+
+    lines = [line.rstrip() for line in error.strip().splitlines() if line.strip()]
+    exception = next((match for match in (_EXCEPTION_LINE.match(line.strip()) for line in reversed(lines)) if match),
+                     None)
+    if exception is None:
+        return None
+
+    exception_type, message = exception.group(1), exception.group(2) or ''
+    symbol = next((match.group(1) for match in (pattern.search(message) for pattern in _SYMBOL_PATTERNS) if match),
+                  None)
+    frames = [match.group(1) or '?' for match in map(_FRAME_LINE.match, lines) if match]
+    if exception_type == 'ModuleNotFoundError' and symbol:
+        symbol = symbol.split('.')[0]
+
+    return '|'.join([exception_type, symbol or '', _normalise_message(message, symbol), '>'.join(frames)])
+
+
+@dataclass
+class IndexedReflection:
+    signature: str
+    reflection: str
+    uses: int = 0
+    successes: int = 0
+
+    @property
+    def success_rate(self) -> float:
+        return (self.successes + 1) / (self.uses + 2)
+
+
+class ErrorSignatureIndex:
+    """
+    Persistent map from error signatures to the reflections generated for them
+        1. lookup returns the reflection of a signature with the best success rate so far
+        2. A reflection is dropped from lookups once it was used min_uses times with a rate under min_success_rate,
+           so the reflection model is asked again
+        3. record_outcome counts whether the retry following a reflection succeeded
+    Stored as one JSON file, rewritten atomically after every change.
+    """
+
+    def __init__(self, path: Optional[str] = '.cache/reflections.json', min_success_rate: float = 0.3,
+                 min_uses: int = 3):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.min_success_rate = min_success_rate
+        self.min_uses = min_uses
+        self.entries: Dict[str, IndexedReflection] = {}
+        self.by_signature: Dict[str, List[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.path and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = {key: IndexedReflection(**entry) for key, entry in json.load(f).items()}
+            for key, entry in self.entries.items():
+                self.by_signature.setdefault(entry.signature, []).append(key)
+
+    @staticmethod
+    def _key(signature: str, reflection: str) -> str:
+        return hashlib.sha1(f"{signature}\n{reflection}".encode()).hexdigest()[:16]
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({key: asdict(entry) for key, entry in self.entries.items()}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _usable(self, entry: IndexedReflection) -> bool:
+        return entry.uses < self.min_uses or entry.successes / entry.uses >= self.min_success_rate
+
+    def lookup(self, signature: str) -> Optional[str]:
+        """Returns the key of the best reflection for the signature, or None on a miss."""
+        with self._lock:
+            candidates = [key for key in self.by_signature.get(signature, []) if self._usable(self.entries[key])]
+            if not candidates:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return max(candidates, key=lambda key: self.entries[key].success_rate)
+
+    def reflection(self, key: str) -> str:
+        return self.entries[key].reflection
+
+    def add(self, signature: str, reflection: str) -> str:
+        key = self._key(signature, reflection)
+        with self._lock:
+            if key not in self.entries:
+                self.entries[key] = IndexedReflection(signature=signature, reflection=reflection)
+                self.by_signature.setdefault(signature, []).append(key)
+                self._save()
+        return key
+
+    def record_outcome(self, key: str, success: bool):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry.uses += 1
+            entry.successes += int(success)
+            self._save()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'reflections': len(self.entries)}
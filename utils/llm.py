@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional, Tuple
+
+import ollama
+
+from utils.cache import ChatCache, chat_key
+from utils.config import ModelConfig, models
+from utils.prompts import PrefixTracker
+from utils.retry import record_tokens
+from utils.scheduler import ModelScheduler
+from utils.streaming import IncrementalJSONValidator, MalformedResponseError
+from utils.tracing import tracer
+
+
+class LLMClient:
+    """
+    Chat client shared by the TaskPlanner, TaskExecutor and Reflection
+        1. Wraps a blocking ollama.Client and an ollama.AsyncClient pointing to the same host
+        2. Limits the number of in-flight async requests per model, and optionally across all models (max_in_flight)
+        3. Serves repeated (model, messages, format) requests from an optional ChatCache
+        4. With a ModelScheduler, requests are grouped by model so models are not swapped in and out constantly
+        5. A PrefixTracker estimates the share of every prompt the server serves from its prompt cache
+    """
+
+    def __init__(self, host: Optional[str] = None, concurrency: Optional[Dict[str, int]] = None,
+                 default_concurrency: int = 2, cache: Optional[ChatCache] = None, max_attempts: int = 3,
+                 max_in_flight: Optional[int] = None, scheduler: Optional[ModelScheduler] = None,
+                 model_config: ModelConfig = models, prefixes: Optional[PrefixTracker] = None):
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.client = ollama.Client(host=host)
+        self.async_client = ollama.AsyncClient(host=host)
+        self.concurrency = concurrency or {}
+        self.default_concurrency = default_concurrency
+        self.cache = cache
+        self.max_attempts = max_attempts
+        self.max_in_flight = max_in_flight
+        self.scheduler = scheduler
+        self.model_config = model_config
+        self.prefixes = prefixes or PrefixTracker()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self._sync_in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.concurrency.get(model, self.default_concurrency))
+        return self._semaphores[model]
+
+    @asynccontextmanager
+    async def _slot(self, model: str, affinity: bool = True):
+        async with self.scheduler.aslot(model) if self.scheduler and affinity else nullcontext():
+            async with self._in_flight or nullcontext():
+                async with self._semaphore(model):
+                    yield
+
+    @contextmanager
+    def _sync_slot(self, model: str, affinity: bool = True):
+        with self.scheduler.slot(model) if self.scheduler and affinity else nullcontext():
+            with self._sync_in_flight or nullcontext():
+                yield
+
+    def _transient(self, error: Exception, attempt: int) -> bool:
+        """Server errors and dropped connections are retried with exponential backoff."""
+        if isinstance(error, ollama.ResponseError) and error.status_code < 500:
+            return False
+        if attempt >= self.max_attempts:
+            return False
+        self.logger.warning(f"Chat request failed (attempt {attempt} of {self.max_attempts}): {error}")
+        return True
+
+    def _chat(self, **kwargs):
+        kwargs.setdefault('keep_alive', self.model_config.keep_alive_for(kwargs['model']))
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self.client.chat(**kwargs)
+            except (ollama.ResponseError, ConnectionError) as e:
+                if not self._transient(e, attempt):
+                    raise
+                time.sleep(0.25 * 2 ** (attempt - 1))
+
+    async def _achat(self, **kwargs):
+        kwargs.setdefault('keep_alive', self.model_config.keep_alive_for(kwargs['model']))
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await self.async_client.chat(**kwargs)
+            except (ollama.ResponseError, ConnectionError) as e:
+                if not self._transient(e, attempt):
+                    raise
+                await asyncio.sleep(0.25 * 2 ** (attempt - 1))
+
+    def _cache_key(self, model, messages, format, options) -> Optional[str]:
+        return chat_key(model, messages, format, options) if self.cache is not None else None
+
+    def _cached(self, key: Optional[str], span):
+        response = self.cache.get(key) if key is not None else None
+        span.set(cache_hit=response is not None)
+        return response
+
+    def _store(self, key: Optional[str], response):
+        return self.cache.put(key, response) if key is not None else response
+
+    def _observe_prefix(self, span, model: str, messages: List) -> Tuple[int, int]:
+        prefix = self.prefixes.observe(model, messages)
+        span.set(prefix_tokens=prefix[0])
+        return prefix
+
+    def _record_usage(self, span, response, start: float, prefix: Tuple[int, int],
+                      first_token: Optional[float] = None):
+        """Token counts and latency of a completion, TTFT falls back to Ollama's load + prompt eval time."""
+        span.set(prompt_tokens=response.get('prompt_eval_count'),
+                 completion_tokens=response.get('eval_count'),
+                 latency=time.perf_counter() - start)
+        record_tokens((response.get('prompt_eval_count') or 0) + (response.get('eval_count') or 0))
+        ttft = None
+        if first_token is not None:
+            ttft = first_token - start
+        elif response.get('prompt_eval_duration') is not None:
+            ttft = ((response.get('load_duration') or 0) + response.get('prompt_eval_duration')) / 1e9
+        if ttft is not None:
+            span.set(ttft=ttft)
+        self.prefixes.record(*prefix, response, ttft)
+
+    def chat(self, model: str, messages: List, format: str = 'json', options: Optional[Dict] = None):
+        with tracer.span('llm.chat', 'llm', model=model, messages=len(messages)) as span:
+            key = self._cache_key(model, messages, format, options)
+            response = self._cached(key, span)
+            if response is not None:
+                return response
+
+            with self._sync_slot(model):
+                prefix = self._observe_prefix(span, model, messages)
+                start = time.perf_counter()
+                response = self._chat(model=model, messages=messages, format=format, options=options)
+            self._record_usage(span, response, start, prefix)
+
+            return self._store(key, response)
+
+    async def achat(self, model: str, messages: List, format: str = 'json', options: Optional[Dict] = None):
+        with tracer.span('llm.chat', 'llm', model=model, messages=len(messages)) as span:
+            key = self._cache_key(model, messages, format, options)
+            response = self._cached(key, span)
+            if response is not None:
+                return response
+
+            async with self._slot(model):
+                prefix = self._observe_prefix(span, model, messages)
+                start = time.perf_counter()
+                response = await self._achat(model=model, messages=messages, format=format, options=options)
+            self._record_usage(span, response, start, prefix)
+
+            return self._store(key, response)
+
+    def _streamed_response(self, validator: IncrementalJSONValidator, last_chunk) -> Dict:
+        response = {'message': {'role': 'assistant', 'content': validator.content()}}
+        if last_chunk is not None and last_chunk.get('done'):
+            for key in ('model', 'prompt_eval_count', 'eval_count', 'prompt_eval_duration', 'eval_duration',
+                        'total_duration', 'load_duration'):
+                if last_chunk.get(key) is not None:
+                    response[key] = last_chunk[key]
+        return response
+
+    def chat_stream(self, model: str, messages: List, validator: Callable[[], IncrementalJSONValidator],
+                    format: str = 'json', options: Optional[Dict] = None, max_attempts: int = 3):
+        """
+        Streams the completion through a fresh validator, aborting and retrying as soon as it is malformed.
+        The stream is also cut once the expected value is complete.
+        """
+        with tracer.span('llm.chat_stream', 'llm', model=model, messages=len(messages)) as span:
+            key = self._cache_key(model, messages, format, options)
+            response = self._cached(key, span)
+            if response is not None:
+                return response
+
+            for attempt in range(1, max_attempts + 1):
+                span.set(attempts=attempt)
+                checker = validator()
+                last_chunk = None
+                first_token = None
+                with self._sync_slot(model):
+                    prefix = self._observe_prefix(span, model, messages)
+                    start = time.perf_counter()
+                    stream = self.client.chat(model=model, messages=messages, format=format, options=options,
+                                              stream=True, keep_alive=self.model_config.keep_alive_for(model))
+                    try:
+                        for last_chunk in stream:
+                            first_token = first_token or time.perf_counter()
+                            checker.feed(last_chunk['message']['content'])
+                            if checker.complete:
+                                break
+                        else:
+                            checker.finish()
+                    except MalformedResponseError as e:
+                        self.logger.warning(f"Aborted malformed {model} response "
+                                            f"(attempt {attempt} of {max_attempts}): {e}")
+                        continue
+                    except (ollama.ResponseError, ConnectionError) as e:
+                        if not self._transient(e, attempt):
+                            raise
+                        continue
+                    finally:
+                        stream.close()
+
+                response = self._streamed_response(checker, last_chunk)
+                self._record_usage(span, response, start, prefix, first_token)
+                return self._store(key, response)
+
+            raise MalformedResponseError(f"{model} returned malformed responses {max_attempts} times")
+
+    async def achat_stream(self, model: str, messages: List, validator: Callable[[], IncrementalJSONValidator],
+                           format: str = 'json', options: Optional[Dict] = None, max_attempts: int = 3):
+        with tracer.span('llm.chat_stream', 'llm', model=model, messages=len(messages)) as span:
+            key = self._cache_key(model, messages, format, options)
+            response = self._cached(key, span)
+            if response is not None:
+                return response
+
+            for attempt in range(1, max_attempts + 1):
+                span.set(attempts=attempt)
+                checker = validator()
+                last_chunk = None
+                first_token = None
+                async with self._slot(model):
+                    prefix = self._observe_prefix(span, model, messages)
+                    start = time.perf_counter()
+                    stream = await self.async_client.chat(model=model, messages=messages, format=format,
+                                                          options=options, stream=True,
+                                                          keep_alive=self.model_config.keep_alive_for(model))
+                    try:
+                        async for last_chunk in stream:
+                            first_token = first_token or time.perf_counter()
+                            checker.feed(last_chunk['message']['content'])
+                            if checker.complete:
+                                break
+                        else:
+                            checker.finish()
+                    except MalformedResponseError as e:
+                        self.logger.warning(f"Aborted malformed {model} response "
+                                            f"(attempt {attempt} of {max_attempts}): {e}")
+                        continue
+                    except (ollama.ResponseError, ConnectionError) as e:
+                        if not self._transient(e, attempt):
+                            raise
+                        continue
+                    finally:
+                        await stream.aclose()
+
+                response = self._streamed_response(checker, last_chunk)
+                self._record_usage(span, response, start, prefix, first_token)
+                return self._store(key, response)
+
+            raise MalformedResponseError(f"{model} returned malformed responses {max_attempts} times")
+
+    # Embedding models are small and stay loaded next to the chat models, so embeddings skip the affinity
+    # scheduler instead of waiting for every in-flight chat request of another model to drain
+    def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        with tracer.span('llm.embed', 'llm', model=model, texts=len(texts)), self._sync_slot(model, affinity=False):
+            return self.client.embed(model=model, input=texts,
+                                     keep_alive=self.model_config.keep_alive_for(model))['embeddings']
+
+    async def aembed(self, model: str, texts: List[str]) -> List[List[float]]:
+        with tracer.span('llm.embed', 'llm', model=model, texts=len(texts)):
+            async with self._slot(model, affinity=False):
+                response = await self.async_client.embed(model=model, input=texts,
+                                                         keep_alive=self.model_config.keep_alive_for(model))
+            return response['embeddings']
+
+
+_default_client: Optional[LLMClient] = None
+
+
+def get_default_client() -> LLMClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = LLMClient()
+    return _default_client
@@ -1,9 +1,6 @@
 from datetime import datetime
 from typing import List, Dict, Literal, Any, Optional
-from dataclasses import dataclass
-import ast
-import traceback
-import ollama
+from dataclasses import dataclass, field
 
 TASK_STATUS = Literal["pending", "in_progress", "failed", "completed"]
 EXECUTION_STATUS = Literal["success", "failure"]
@@ -21,6 +18,7 @@ class Message:
 class Response:
     task: str
     response: str
+    execution_time: float = 0.0
 
 
 @dataclass
@@ -29,11 +27,13 @@ class Task:
     name: str
     description: str
     status: TASK_STATUS = 'pending'
-    task_feedbacks = []
     max_retries: int = 3
     retry_count: int = 0
     task_count: int = 0
-    task_tracker = {'previous_tasks': [], 'original_query': '', 'responses': ''}
+    dependencies: List[int] = field(default_factory=list)
+    task_feedbacks: List[str] = field(default_factory=list)
+    task_tracker: Dict[str, Any] = field(
+        default_factory=lambda: {'previous_tasks': [], 'original_query': '', 'responses': ''})
 
 
 @dataclass
@@ -47,6 +47,8 @@ class ExecutionResult:
     output: Any = None
     error: Optional[str] = None
     execution_time: float = 0.0
+    stdout: str = ''
+    stderr: str = ''
 
 
 @dataclass
@@ -0,0 +1,170 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.config import models
+from utils.llm import LLMClient, get_default_client
+
+
+@dataclass
+class CachedPlan:
+    query: str
+    tasks: List[Dict]
+    embedding: List[float]
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+@dataclass
+class PlanMatch:
+    key: str
+    query: str
+    tasks: List[Dict]
+    score: float
+
+
+class PlanCache:
+    """
+    Plans of previous queries, looked up by the cosine similarity of the query embeddings
+        1. lookup returns the stored plan of the most similar query scoring at least threshold
+        2. Least recently used plans are evicted past max_entries, plans older than max_age seconds are ignored
+        3. invalidate drops a plan, e.g. after one of its tasks failed
+    Stored as one JSON file, rewritten atomically by put, invalidate and close. A hit only updates the usage
+    counters in memory, they are written with the next change, so lookup never waits on the file.
+    """
+
+    def __init__(self, path: Optional[str] = '.cache/plans.json', client: LLMClient = None,
+                 embedding_model: str = models.embedding, threshold: float = 0.92, max_entries: int = 1000,
+                 max_age: Optional[float] = 30 * 24 * 3600):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.client = client or get_default_client()
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries: Dict[str, CachedPlan] = {}
+        self.hits = 0
+        self.misses = 0
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if self.path and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = {key: CachedPlan(**entry) for key, entry in json.load(f).items()}
+
+    @staticmethod
+    def key(query: str) -> str:
+        return hashlib.sha1(query.strip().lower().encode()).hexdigest()[:16]
+
+    def _save(self):
+        self._dirty = False
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({key: asdict(entry) for key, entry in self.entries.items()}, f)
+        os.replace(tmp_path, self.path)
+
+    def _remember_embedding(self, query: str, embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        if len(self._embeddings) >= 256:
+            self._embeddings.pop(next(iter(self._embeddings)))
+        self._embeddings[query] = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+        return self._embeddings[query]
+
+    def _embed(self, query: str) -> np.ndarray:
+        if query not in self._embeddings:
+            return self._remember_embedding(query, self.client.embed(self.embedding_model, [query])[0])
+        return self._embeddings[query]
+
+    async def _aembed(self, query: str) -> np.ndarray:
+        if query not in self._embeddings:
+            return self._remember_embedding(query, (await self.client.aembed(self.embedding_model, [query]))[0])
+        return self._embeddings[query]
+
+    def _expired(self, entry: CachedPlan) -> bool:
+        return self.max_age is not None and time.time() - entry.created_at > self.max_age
+
+    def lookup(self, query: str) -> Optional[PlanMatch]:
+        try:
+            embedding = self._embed(query)
+        except Exception as e:
+            self.logger.warning(f"Could not embed the query, skipping the plan cache: {e}")
+            return None
+        return self._match(embedding)
+
+    async def alookup(self, query: str) -> Optional[PlanMatch]:
+        """lookup for the event loop, the query is embedded with the async client and the file is not touched."""
+        try:
+            embedding = await self._aembed(query)
+        except Exception as e:
+            self.logger.warning(f"Could not embed the query, skipping the plan cache: {e}")
+            return None
+        return self._match(embedding)
+
+    def _match(self, embedding: np.ndarray) -> Optional[PlanMatch]:
+        with self._lock:
+            keys = [key for key, entry in self.entries.items()
+                    if not self._expired(entry) and len(entry.embedding) == len(embedding)]
+            if not keys:
+                self.misses += 1
+                return None
+
+            scores = np.asarray([self.entries[key].embedding for key in keys], dtype=np.float32) @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry = self.entries[keys[best]]
+            entry.last_used = time.time()
+            entry.hits += 1
+            self.hits += 1
+            self._dirty = True
+            return PlanMatch(key=keys[best], query=entry.query, tasks=copy.deepcopy(entry.tasks),
+                             score=float(scores[best]))
+
+    def put(self, query: str, tasks: List[Dict]) -> Optional[str]:
+        try:
+            embedding = self._embed(query)
+        except Exception as e:
+            self.logger.warning(f"Could not embed the query, the plan is not cached: {e}")
+            return None
+
+        key = self.key(query)
+        with self._lock:
+            self.entries[key] = CachedPlan(query=query, tasks=copy.deepcopy(tasks), embedding=embedding.tolist())
+            for expired in [k for k, entry in self.entries.items() if self._expired(entry)]:
+                del self.entries[expired]
+            while len(self.entries) > self.max_entries:
+                del self.entries[min(self.entries, key=lambda k: self.entries[k].last_used)]
+            self._save()
+        return key
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self.logger.info(f"Invalidated cached plan {key}")
+                self._save()
+
+    def close(self):
+        """Writes the usage counters of the hits since the last change."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'plans': len(self.entries)}
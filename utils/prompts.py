@@ -0,0 +1,102 @@
+import textwrap
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import ollama
+
+from utils.context import estimate_tokens
+
+"""
+Prompt assembly for prompt (KV) cache reuse on the model server.
+The server skips the prompt processing of the longest prefix a new prompt shares with one it processed before,
+so every prompt is laid out as a byte-stable system prompt followed by the variable blocks, the most stable first.
+"""
+
+
+def static_prompt(text: str) -> str:
+    """Dedented, stripped prompt text, built once at import time so every request sends the same bytes."""
+    return textwrap.dedent(text).strip() + '\n'
+
+
+def assemble(system: str, *blocks: Tuple[str, Optional[str]]) -> List[ollama.Message]:
+    """The system prompt, then the non-empty (role, content) blocks in the given order, most stable first."""
+    return [ollama.Message(role='system', content=system)] + \
+        [ollama.Message(role=role, content=content) for role, content in blocks if content]
+
+
+def serialize_messages(messages: Sequence) -> str:
+    """Flat text of the messages in the order the chat template lays them out."""
+    return ''.join(f"<|{message['role']}|>{message['content']}" for message in messages)
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """Length of the common prefix, by binary search over slice comparisons."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class PrefixTracker:
+    """
+    Estimates how much of every prompt the model server serves from its prompt cache
+        1. The last `slots` prompts of each model are kept, like the parallel slots of an Ollama runner, and a new
+           prompt reuses the longest prefix it shares with one of them
+        2. A call is a hit when at least hit_ratio of its prompt is reused
+        3. stats() reports the prefix hit ratio, the mean TTFT of hits and misses, and the prompt processing time
+           saved by the reused prefixes, priced at the measured prompt eval time per token
+    """
+
+    def __init__(self, slots: int = 4, hit_ratio: float = 0.5):
+        self.slots = slots
+        self.hit_ratio = hit_ratio
+        self._prompts: Dict[str, List[str]] = {}
+        self._calls = 0
+        self._prompt_tokens = 0
+        self._prefix_tokens = 0
+        self._ttft = {'hit': [0, 0.0], 'miss': [0, 0.0]}
+        self._eval_tokens = 0
+        self._eval_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, messages: Sequence) -> Tuple[int, int]:
+        """Estimated (reused prefix, prompt) tokens of a prompt about to be sent to the model."""
+        prompt = serialize_messages(messages)
+        with self._lock:
+            recent = self._prompts.setdefault(model, [])
+            prefix = max((common_prefix_length(prompt, previous) for previous in recent), default=0)
+            recent.append(prompt)
+            del recent[:-self.slots]
+        return estimate_tokens(prompt[:prefix]) if prefix else 0, estimate_tokens(prompt)
+
+    def record(self, prefix_tokens: int, prompt_tokens: int, response, ttft: Optional[float] = None):
+        hit = prompt_tokens > 0 and prefix_tokens >= self.hit_ratio * prompt_tokens
+        with self._lock:
+            self._calls += 1
+            self._prompt_tokens += prompt_tokens
+            self._prefix_tokens += prefix_tokens
+            if ttft is not None:
+                stats = self._ttft['hit' if hit else 'miss']
+                stats[0] += 1
+                stats[1] += ttft
+            if response.get('prompt_eval_count') and response.get('prompt_eval_duration'):
+                self._eval_tokens += response['prompt_eval_count']
+                self._eval_seconds += response['prompt_eval_duration'] / 1e9
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            ttft = {kind: total / count if count else None for kind, (count, total) in self._ttft.items()}
+            seconds_per_token = self._eval_seconds / self._eval_tokens if self._eval_tokens else None
+            return {'calls': self._calls,
+                    'prompt_tokens': self._prompt_tokens,
+                    'prefix_tokens': self._prefix_tokens,
+                    'prefix_hit_ratio': round(self._prefix_tokens / self._prompt_tokens, 3)
+                    if self._prompt_tokens else None,
+                    'ttft_hit': round(ttft['hit'], 4) if ttft['hit'] is not None else None,
+                    'ttft_miss': round(ttft['miss'], 4) if ttft['miss'] is not None else None,
+                    'ttft_saved': round(self._prefix_tokens * seconds_per_token, 3)
+                    if seconds_per_token is not None else None}
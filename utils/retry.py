@@ -0,0 +1,120 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from utils.config import models
+from utils.model import Task
+
+_budgets: contextvars.ContextVar[Tuple['Budget', ...]] = contextvars.ContextVar('budgets', default=())
+
+
+def record_tokens(tokens: int):
+    """Charges the tokens of an LLM call to every budget of the current context (task and plan)."""
+    for budget in _budgets.get():
+        budget.add(tokens)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the nearest deadline of the current context, None when nothing is bounded."""
+    remaining = [budget.remaining() for budget in _budgets.get() if budget.deadline is not None]
+    return max(min(remaining), 0.0) if remaining else None
+
+
+class Budget:
+    """Wall-clock deadline and token allowance, either may be None for unlimited."""
+
+    def __init__(self, deadline: Optional[float] = None, token_budget: Optional[int] = None):
+        self.start = time.monotonic()
+        self.deadline = deadline
+        self.token_budget = token_budget
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, tokens: int):
+        with self._lock:
+            self.tokens += tokens
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - self.elapsed
+
+    def exceeded(self) -> Optional[str]:
+        if self.deadline is not None and self.elapsed >= self.deadline:
+            return f"deadline of {self.deadline:.0f}s exceeded"
+        if self.token_budget is not None and self.tokens >= self.token_budget:
+            return f"token budget of {self.token_budget} exceeded ({self.tokens} tokens)"
+        return None
+
+    @contextmanager
+    def metered(self):
+        token = _budgets.set(_budgets.get() + (self,))
+        try:
+            yield self
+        finally:
+            _budgets.reset(token)
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Bounds the attempts of every task and of the whole plan
+        1. max_retries (task.max_retries when None), task / plan deadlines in seconds and token budgets
+        2. Exponential backoff between attempts, from backoff up to backoff_max seconds
+        3. After escalate_after failures the code is generated by escalation_model instead, off unless set
+        4. After replan_after failures the planner is asked to rewrite the task
+        5. Only the latest max_feedbacks reflections, each cut to max_feedback_chars, are kept on a task
+    """
+    max_retries: Optional[int] = None
+    task_deadline: Optional[float] = 300.0
+    plan_deadline: Optional[float] = None
+    task_token_budget: Optional[int] = 32000
+    plan_token_budget: Optional[int] = None
+    backoff: float = 0.5
+    backoff_max: float = 8.0
+    escalate_after: Optional[int] = None
+    escalation_model: Optional[str] = models.escalation
+    replan_after: Optional[int] = None
+    max_feedbacks: int = 2
+    max_feedback_chars: int = 2000
+
+    def plan_budget(self) -> Budget:
+        return Budget(self.plan_deadline, self.plan_token_budget)
+
+    def task_budget(self) -> Budget:
+        return Budget(self.task_deadline, self.task_token_budget)
+
+    def retries_for(self, task: Task) -> int:
+        return task.max_retries if self.max_retries is None else self.max_retries
+
+    def stop_reason(self, task: Task, *budgets: Budget) -> Optional[str]:
+        """Why the task must not be retried again, None while it may."""
+        if task.retry_count >= self.retries_for(task):
+            return f"all {self.retries_for(task)} attempts failed"
+        return next((reason for reason in (budget.exceeded() for budget in budgets if budget is not None) if reason),
+                    None)
+
+    def delay(self, task: Task) -> float:
+        """Backoff before the next attempt, never past the nearest deadline of the current context."""
+        if not self.backoff or task.retry_count < 1:
+            return 0.0
+        delay = min(self.backoff * 2 ** (task.retry_count - 1), self.backoff_max)
+        remaining = remaining_time()
+        return delay if remaining is None else min(delay, remaining)
+
+    def model_for(self, task: Task, default: str) -> str:
+        if self.escalation_model and self.escalate_after is not None and task.retry_count >= self.escalate_after:
+            return self.escalation_model
+        return default
+
+    def should_replan(self, task: Task) -> bool:
+        return self.replan_after is not None and task.retry_count == self.replan_after
+
+    def cap_feedbacks(self, feedbacks: List[str]) -> List[str]:
+        return [feedback if len(feedback) <= self.max_feedback_chars else feedback[:self.max_feedback_chars] + '...'
+                for feedback in feedbacks[-self.max_feedbacks:]]
@@ -0,0 +1,218 @@
+import atexit
+import builtins
+import io
+import logging
+import multiprocessing
+import queue
+import sys
+import time
+import traceback
+import types
+from contextlib import redirect_stdout, redirect_stderr
+from typing import Dict, Optional, Sequence
+
+from utils.model import ExecutionResult
+from utils.session import SESSION_MODULE
+
+PRELOAD_MODULES = ('numpy', 'pandas', 'matplotlib', 'matplotlib.pyplot')
+
+
+def _preload(modules: Sequence[str]):
+    for name in modules:
+        try:
+            if name == 'matplotlib.pyplot':
+                import matplotlib
+                matplotlib.use('Agg')
+            __import__(name)
+        except Exception:
+            pass
+
+
+def _session_module(sessions: Dict, session: Dict, max_sessions: int = 8) -> types.ModuleType:
+    """
+    The module of a session, rebuilt only when the worker has not seen its current version yet.
+    A definition failing to build is reported on stderr, the module keeps the names bound before it.
+    """
+    cached = sessions.get(session['id'])
+    if cached is not None and cached[0] == session['version']:
+        return cached[1]
+
+    module = types.ModuleType(SESSION_MODULE)
+    try:
+        exec(compile(session['source'], f'<{SESSION_MODULE}>', 'exec'), module.__dict__)
+    except Exception as e:
+        print(f"Session {SESSION_MODULE} partially built: {type(e).__name__}: {e}", file=sys.stderr)
+
+    sessions.pop(session['id'], None)
+    sessions[session['id']] = (session['version'], module)
+    while len(sessions) > max_sessions:
+        sessions.pop(next(iter(sessions)))
+    return module
+
+
+def _worker_main(conn, preload: Sequence[str], memory_limit: Optional[int]):
+    _preload(preload)
+    sessions = {}
+
+    if memory_limit:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, ValueError, OSError):
+            pass
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        namespace = {'__name__': '__main__', '__builtins__': builtins}
+        error = None
+
+        start = time.perf_counter()
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                # A snippet without a session, e.g. of another plan or query, must not import the last one's
+                sys.modules.pop(SESSION_MODULE, None)
+                if request.get('session'):
+                    module = _session_module(sessions, request['session'])
+                    sys.modules[SESSION_MODULE] = module
+                    namespace.update((name, value) for name, value in vars(module).items()
+                                     if not name.startswith('__'))
+                exec(compile(request['code'], '<generated>', 'exec'), namespace)
+        except BaseException as e:
+            error = ''.join(traceback.format_exception(type(e), e, e.__traceback__.tb_next))
+        finally:
+            sys.modules.pop(SESSION_MODULE, None)
+        elapsed = time.perf_counter() - start
+
+        conn.send({'status': 'failure' if error else 'success',
+                   'error': error,
+                   'stdout': stdout.getvalue(),
+                   'stderr': stderr.getvalue(),
+                   'execution_time': elapsed})
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+    def kill(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+
+
+class ExecutionPool:
+    """
+    Pool of warm worker processes that execute generated code
+        1. Workers are forked with PRELOAD_MODULES already imported
+        2. Every snippet runs in a fresh namespace with stdout / stderr captured, pre-filled with the names of
+           its ExecutionSession when one is passed
+        3. A snippet exceeding the wall-clock timeout is killed and its worker replaced
+        4. The address space of every worker is capped to memory_limit bytes
+    """
+
+    def __init__(self, size: int = 4, timeout: float = 30.0, memory_limit: Optional[int] = 2 * 1024 ** 3,
+                 preload: Sequence[str] = PRELOAD_MODULES):
+        self.logger = logging.getLogger(__name__)
+        self.size = size
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.preload = tuple(preload)
+
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context('forkserver')
+            self._context.set_forkserver_preload(['utils.sandbox', *self.preload])
+        else:
+            self._context = multiprocessing.get_context('spawn')
+
+        self._idle: queue.Queue = queue.Queue()
+        self._workers = []
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+        atexit.register(self.close)
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main,
+                                        args=(child_conn, self.preload, self.memory_limit),
+                                        daemon=True)
+        process.start()
+        child_conn.close()
+
+        worker = _Worker(process, parent_conn)
+        self._workers.append(worker)
+        return worker
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        self._workers.remove(worker)
+        return self._spawn()
+
+    def run(self, code: str, timeout: Optional[float] = None, session: Optional[Dict] = None) -> ExecutionResult:
+        timeout = timeout or self.timeout
+        worker = self._idle.get()
+        start = time.perf_counter()
+
+        try:
+            worker.conn.send({'code': code, 'session': session})
+            if not worker.conn.poll(timeout):
+                self.logger.warning(f"Execution timed out after {timeout}s, restarting worker {worker.process.pid}")
+                worker = self._replace(worker)
+                return ExecutionResult(status='failure', output=code,
+                                       error=f"TimeoutError: execution exceeded {timeout}s",
+                                       execution_time=time.perf_counter() - start)
+            reply = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join(timeout=1)
+            exitcode = worker.process.exitcode
+            self.logger.warning(f"Worker {worker.process.pid} died with exit code {exitcode}, restarting it")
+            worker = self._replace(worker)
+            return ExecutionResult(status='failure', output=code,
+                                   error=f"Execution worker died (exit code {exitcode}), "
+                                         f"the code may have exceeded the memory limit",
+                                   execution_time=time.perf_counter() - start)
+        finally:
+            self._idle.put(worker)
+
+        return ExecutionResult(status=reply['status'], output=code, error=reply['error'],
+                               execution_time=reply['execution_time'],
+                               stdout=reply['stdout'], stderr=reply['stderr'])
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=1)
+            worker.kill()
+        self._workers.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with ExecutionPool(size=2, timeout=2) as pool:
+        print(pool.run("print('hello from the sandbox')"))
+        print(pool.run("while True:\n    pass"))
+        print(pool.run("raise ValueError('bad code')"))
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Deque, Dict, Optional
+
+
+class _Waiter:
+    def __init__(self, model: str, wake: Callable[[], None]):
+        self.model = model
+        self.wake = wake
+        self.admitted = False
+
+
+class ModelScheduler:
+    """
+    Groups LLM requests by model so the server keeps one model loaded at a time
+        1. Requests for the active model are admitted right away, requests for other models queue up
+        2. Once the active model has no requests running, the model with the most queued requests becomes active
+           and all of its queued requests are released together
+        3. After max_batch requests in a row, new requests for the active model queue up as well when
+           another model is waiting, so no model starves
+    Every caller awaits its own request, so the requests of one task are still sent in order.
+    Works for threads (slot) and asyncio tasks (aslot) sharing the same state.
+    """
+
+    def __init__(self, max_batch: int = 64):
+        self.logger = logging.getLogger(__name__)
+        self.max_batch = max_batch
+        self.active: Optional[str] = None
+        self.loads = 0
+        self.served = 0
+        self.running: Dict[str, int] = defaultdict(int)
+        self.waiting: Dict[str, Deque[_Waiter]] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def _others_waiting(self) -> bool:
+        return any(queue for model, queue in self.waiting.items() if model != self.active)
+
+    def _switch(self, model: str):
+        if self.active is not None:
+            self.logger.info(f"Switching from {self.active} to {model} "
+                             f"({len(self.waiting[model])} requests queued)")
+        self.active = model
+        self.loads += 1
+        self.served = 0
+
+    def _admit_now(self, model: str) -> bool:
+        if self.active is None or (model != self.active and not self.running[self.active]
+                                   and not self.waiting[self.active]):
+            self._switch(model)
+            return True
+        return model == self.active and not (self.served >= self.max_batch and self._others_waiting())
+
+    def _start(self, waiter: _Waiter):
+        waiter.admitted = True
+        self.running[waiter.model] += 1
+        self.served += 1
+        waiter.wake()
+
+    def _dispatch(self):
+        if self.running[self.active]:
+            return
+
+        candidates = {model: queue for model, queue in self.waiting.items() if queue and model != self.active}
+        if candidates and (self.served >= self.max_batch or not self.waiting[self.active]):
+            self._switch(max(candidates, key=lambda model: len(candidates[model])))
+
+        queue = self.waiting[self.active]
+        while queue:
+            self._start(queue.popleft())
+
+    def _enter(self, model: str, wake: Callable[[], None]) -> _Waiter:
+        waiter = _Waiter(model, wake)
+        with self._lock:
+            if self._admit_now(model):
+                self._start(waiter)
+            else:
+                self.waiting[model].append(waiter)
+        return waiter
+
+    def _abandon(self, waiter: _Waiter):
+        with self._lock:
+            if waiter.admitted:
+                self._release_locked(waiter.model)
+            else:
+                self.waiting[waiter.model].remove(waiter)
+                self._dispatch()
+
+    def _release_locked(self, model: str):
+        self.running[model] -= 1
+        self._dispatch()
+
+    def _release(self, model: str):
+        with self._lock:
+            self._release_locked(model)
+
+    @contextmanager
+    def slot(self, model: str):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # The requests holding the active model may be coroutines of this very loop, waiting would deadlock
+            raise RuntimeError(f"ModelScheduler.slot({model!r}) called on an event loop thread, use aslot")
+
+        event = threading.Event()
+        waiter = self._enter(model, event.set)
+        try:
+            event.wait()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(model)
+
+    @asynccontextmanager
+    async def aslot(self, model: str):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enter(model, wake)
+        try:
+            await future
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(model)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'loads': self.loads,
+                    'running': sum(self.running.values()),
+                    'queued': sum(len(queue) for queue in self.waiting.values())}
@@ -0,0 +1,204 @@
+import ast
+import builtins
+import threading
+import uuid
+from typing import Dict, List, Optional, Set
+
+from utils.context import estimate_tokens, summarize_code
+
+SESSION_MODULE = 'session'
+_BUILTINS = frozenset(dir(builtins))
+_SIDE_EFFECTS = (ast.Call, ast.Await, ast.Yield, ast.YieldFrom, ast.NamedExpr)
+
+
+def _is_pure(node: ast.AST) -> bool:
+    """Expression without calls, e.g. a constant or an alias like List[float], safe to evaluate again."""
+    return not any(isinstance(child, _SIDE_EFFECTS) for child in ast.walk(node))
+
+
+def _loaded_names(nodes) -> Set[str]:
+    """Free names the expressions read, minus the ones bound by their own comprehensions and lambdas."""
+    loaded, bound = set(), set()
+    for node in nodes:
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name):
+                (loaded if isinstance(child.ctx, ast.Load) else bound).add(child.id)
+            elif isinstance(child, ast.arg):
+                bound.add(child.arg)
+    return loaded - bound
+
+
+def _definition_time_names(node: ast.stmt) -> Set[str]:
+    """Names a top-level statement reads when it runs, the bodies of functions only run when called."""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        arguments = node.args
+        annotations = [arg.annotation for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs +
+                       [arguments.vararg, arguments.kwarg] if arg is not None and arg.annotation is not None]
+        return _loaded_names(node.decorator_list + arguments.defaults +
+                             [default for default in arguments.kw_defaults if default is not None] +
+                             annotations + ([node.returns] if node.returns else []))
+    if isinstance(node, ast.ClassDef):
+        names = _loaded_names(node.decorator_list + node.bases + [keyword.value for keyword in node.keywords])
+        for statement in node.body:
+            if not isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                names |= _loaded_names([statement])
+            else:
+                names |= _definition_time_names(statement)
+        return names
+    if isinstance(node, (ast.Assign, ast.AnnAssign)):
+        return _loaded_names([node.value])
+    return set()
+
+
+def _bound_names(node: ast.stmt) -> Set[str]:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {node.name}
+    if isinstance(node, ast.Import):
+        return {alias.asname or alias.name.split('.')[0] for alias in node.names}
+    if isinstance(node, ast.ImportFrom):
+        return {alias.asname or alias.name for alias in node.names}
+    if isinstance(node, ast.Assign):
+        return {target.id for target in node.targets if isinstance(target, ast.Name)}
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return {node.target.id}
+    return set()
+
+
+def extract_definitions(code: str) -> Dict[str, str]:
+    """
+    Top-level definitions of the code that are safe to run again, keyed by the name they bind
+        1. Imports, keyed by their source line
+        2. Functions and classes, with their decorators
+        3. Assignments of expressions without calls, e.g. constants or type aliases like Vector = List[float]
+    Everything else, e.g. the __main__ block or calls with side effects, is left out.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return {}
+
+    definitions = {}
+    for node in tree.body:
+        source = ast.get_source_segment(code, node)
+        if source is None:
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            decorators = ''.join(f"@{ast.get_source_segment(code, decorator)}\n" for decorator in node.decorator_list)
+            definitions[node.name] = decorators + source
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            if isinstance(node, ast.ImportFrom) and node.module == SESSION_MODULE:
+                continue
+            definitions[f"import:{source}"] = source
+        elif isinstance(node, ast.Assign) and _is_pure(node.value) and \
+                all(isinstance(target, ast.Name) for target in node.targets):
+            for target in node.targets:
+                definitions[target.id] = source
+        elif isinstance(node, ast.AnnAssign) and node.value is not None and _is_pure(node.value) and \
+                isinstance(node.target, ast.Name):
+            definitions[node.target.id] = source
+    return definitions
+
+
+def _resolvable(definitions: Dict[str, str]) -> Dict[str, str]:
+    """
+    The definitions that can be built in the order of the session source
+        1. A definition whose source does not compile is dropped
+        2. A definition reading, when it runs, a name that no import, builtin or earlier definition binds is
+           dropped, with everything that depends on it
+    Nothing is executed, the generated code only ever runs in the sandbox.
+    """
+    statements = {}
+    for name, source in definitions.items():
+        try:
+            statements[name] = ast.parse(source).body
+        except SyntaxError:
+            continue
+
+    bound = set(_BUILTINS)
+    for name, body in statements.items():
+        if name.startswith('import:'):
+            bound.update(*(_bound_names(node) for node in body))
+
+    resolvable = {}
+    for name, source in definitions.items():
+        body = statements.get(name)
+        if body is None:
+            continue
+        if not name.startswith('import:'):
+            if any(_definition_time_names(node) - bound for node in body):
+                continue
+            bound.update(*(_bound_names(node) for node in body))
+        resolvable[name] = source
+    return resolvable
+
+
+class ExecutionSession:
+    """
+    Persistent module namespace shared by the tasks of one plan
+        1. register() adds the definitions of every successful task to the `session` module, a redefinition wins,
+           and drops the ones the module could not build, e.g. a function annotated with an alias left out
+        2. The sandbox workers build the module once per version and expose its names to the next tasks,
+           which can also `from session import name`
+        3. symbols() / render() give the prompt a table of the available signatures instead of their source
+    """
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.version = 0
+        self._definitions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names())
+
+    def register(self, code: str) -> List[str]:
+        definitions = extract_definitions(code)
+        with self._lock:
+            merged = dict(self._definitions)
+            for name, source in definitions.items():
+                if merged.get(name) != source:
+                    merged.pop(name, None)
+                    merged[name] = source
+            merged = _resolvable(merged)
+            changed = [name for name, source in merged.items() if self._definitions.get(name) != source]
+            if changed or len(merged) != len(self._definitions):
+                self._definitions = merged
+                self.version += 1
+        return [name for name in changed if not name.startswith('import:')]
+
+    @property
+    def source(self) -> str:
+        with self._lock:
+            definitions = list(self._definitions.items())
+        imports = [source for name, source in definitions if name.startswith('import:')]
+        bodies = list(dict.fromkeys(source for name, source in definitions if not name.startswith('import:')))
+        return '\n'.join(imports) + '\n\n\n' + '\n\n\n'.join(bodies) + '\n'
+
+    def names(self) -> Set[str]:
+        """Names bound in the session module, imports included."""
+        try:
+            tree = ast.parse(self.source)
+        except SyntaxError:
+            return set()
+
+        return set().union(*(_bound_names(node) for node in tree.body))
+
+    def payload(self) -> Optional[Dict]:
+        """What the sandbox needs to rebuild the module, None while nothing is registered."""
+        if not self.version:
+            return None
+        return {'id': self.session_id, 'version': self.version, 'source': self.source}
+
+    def symbols(self) -> List[str]:
+        return summarize_code(self.source)
+
+    def render(self, token_budget: int) -> str:
+        lines, used = [], 0
+        for line in self.symbols():
+            tokens = estimate_tokens(line)
+            if used + tokens > token_budget:
+                lines.append("...")
+                break
+            lines.append(line)
+            used += tokens
+        return '\n'.join(lines)
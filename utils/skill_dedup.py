@@ -0,0 +1,289 @@
+import ast
+import builtins
+import re
+import zlib
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from utils.model import Skill
+
+_PRIME = 4294967291
+_BUILTINS = frozenset(dir(builtins))
+
+
+def _is_main_guard(node: ast.AST) -> bool:
+    return (isinstance(node, ast.If) and isinstance(node.test, ast.Compare) and
+            isinstance(node.test.left, ast.Name) and node.test.left.id == '__name__')
+
+
+class _Normalizer(ast.NodeTransformer):
+    """Drops docstrings and annotations, renames the names bound by the code in order of appearance."""
+
+    def __init__(self, bound: Set[str]):
+        self.bound = bound
+        self.renames: Dict[str, str] = {}
+
+    def _rename(self, name: str) -> str:
+        if name not in self.bound:
+            return name
+        return self.renames.setdefault(name, f"v{len(self.renames)}")
+
+    def _strip_docstring(self, node):
+        if node.body and isinstance(node.body[0], ast.Expr) and isinstance(node.body[0].value, ast.Constant) \
+                and isinstance(node.body[0].value.value, str):
+            node.body = node.body[1:] or [ast.Pass()]
+        return node
+
+    def visit_Module(self, node):
+        node.body = [child for child in node.body if not _is_main_guard(child)]
+        return self.generic_visit(self._strip_docstring(node))
+
+    def _visit_definition(self, node):
+        node.name = self._rename(node.name)
+        if not isinstance(node, ast.ClassDef):
+            node.returns = None
+        return self.generic_visit(self._strip_docstring(node))
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_definition
+
+    def visit_arg(self, node):
+        node.arg = self._rename(node.arg)
+        node.annotation = None
+        return node
+
+    def visit_Name(self, node):
+        node.id = self._rename(node.id)
+        return node
+
+
+def _bound_names(tree: ast.AST) -> Set[str]:
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.add(node.id)
+    return bound - _BUILTINS
+
+
+def _tokens(node: ast.AST) -> Iterator[str]:
+    """Pre-order walk of the tree, one token per node with its name, attribute or constant."""
+    label = type(node).__name__
+    for attribute in ('id', 'attr', 'name', 'arg', 'module'):
+        value = getattr(node, attribute, None)
+        if isinstance(value, str):
+            label += f":{value}"
+    if isinstance(node, ast.Constant):
+        label += f":{node.value!r}"
+    elif isinstance(node, (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.AugAssign)):
+        label += f":{type(node.op).__name__}"
+    elif isinstance(node, ast.Compare):
+        label += ':' + ','.join(type(op).__name__ for op in node.ops)
+    yield label
+    for child in ast.iter_child_nodes(node):
+        if not isinstance(child, (ast.expr_context, ast.operator, ast.unaryop, ast.boolop, ast.cmpop)):
+            yield from _tokens(child)
+
+
+def _code_tokens(code: str) -> List[str]:
+    """Tokens of the normalised AST, constants included, the raw lines when the code does not parse."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return [line.strip() for line in code.splitlines() if line.strip()]
+    return list(_tokens(_Normalizer(_bound_names(tree)).visit(tree)))
+
+
+def same_code(a: str, b: str) -> bool:
+    """Whether the two codes only differ in names, docstrings, annotations, comments and layout."""
+    return _code_tokens(a or '') == _code_tokens(b or '')
+
+
+def code_shingles(code: str, k: int = 5) -> Set[str]:
+    """k-grams of the tokens of the normalised AST, the raw lines when the code does not parse."""
+    tokens = _code_tokens(code)
+    if len(tokens) <= k:
+        return {' '.join(tokens)}
+    return {' '.join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+
+
+class SkillDeduplicator:
+    """
+    Near-duplicate detection over the code of the skills
+        1. The code is normalised (docstrings, annotations and the __main__ block dropped, the names it binds
+           renamed) and shingled over its AST, constants are kept so code only differing in its strings stays apart
+        2. MinHash signatures split in LSH bands give the candidates, their estimated Jaccard similarity must reach
+           code_threshold
+        3. When both skills have an embedding of their name and description, its cosine similarity must also reach
+           embedding_threshold
+    """
+
+    def __init__(self, code_threshold: float = 0.8, embedding_threshold: float = 0.85, num_perm: int = 64,
+                 bands: int = 16, seed: int = 0):
+        if num_perm % bands:
+            raise ValueError(f"num_perm {num_perm} is not a multiple of bands {bands}")
+        self.code_threshold = code_threshold
+        self.embedding_threshold = embedding_threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.embeddings: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, name: str):
+        return name in self.signatures
+
+    def signature(self, code: str) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) & 0x7fffffff for shingle in code_shingles(code or '')),
+                             dtype=np.uint64)
+        return ((np.outer(hashes, self._a) + self._b) % _PRIME).min(axis=0)
+
+    def _bands(self, signature: np.ndarray) -> Iterator[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    @staticmethod
+    def _normalise(embedding) -> Optional[np.ndarray]:
+        if embedding is None:
+            return None
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def add(self, name: str, code: str, embedding=None):
+        self.remove(name)
+        signature = self.signature(code)
+        self.signatures[name] = signature
+        if embedding is not None:
+            self.embeddings[name] = self._normalise(embedding)
+        for band, key in self._bands(signature):
+            self._buckets[band].setdefault(key, set()).add(name)
+
+    def remove(self, name: str):
+        signature = self.signatures.pop(name, None)
+        self.embeddings.pop(name, None)
+        if signature is None:
+            return
+        for band, key in self._bands(signature):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(name)
+                if not bucket:
+                    del self._buckets[band][key]
+
+    def _candidates(self, signature: np.ndarray) -> Set[str]:
+        candidates = set()
+        for band, key in self._bands(signature):
+            candidates.update(self._buckets[band].get(key, ()))
+        return candidates
+
+    def _similar(self, signature: np.ndarray, embedding: Optional[np.ndarray], name: str) -> Optional[float]:
+        score = float(np.mean(self.signatures[name] == signature))
+        if score < self.code_threshold:
+            return None
+        other = self.embeddings.get(name)
+        if embedding is not None and other is not None and float(embedding @ other) < self.embedding_threshold:
+            return None
+        return score
+
+    def find(self, code: str, embedding=None, exclude: str = None) -> Optional[Tuple[str, float]]:
+        """Name and estimated code similarity of the closest near-duplicate, None when there is none."""
+        signature = self.signature(code)
+        embedding = self._normalise(embedding)
+        best = None
+        for name in self._candidates(signature) - {exclude}:
+            score = self._similar(signature, embedding, name)
+            if score is not None and (best is None or score > best[1]):
+                best = (name, score)
+        return best
+
+    def clusters(self) -> List[List[str]]:
+        """Groups of two or more near-duplicate skills, pairs are taken from the shared LSH buckets."""
+        parent = {name: name for name in self.signatures}
+
+        def root(name: str) -> str:
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        for name, signature in self.signatures.items():
+            for other in self._candidates(signature):
+                if other <= name or root(other) == root(name):
+                    continue
+                if self._similar(signature, self.embeddings.get(name), other) is not None:
+                    parent[root(other)] = root(name)
+
+        groups: Dict[str, List[str]] = {}
+        for name in self.signatures:
+            groups.setdefault(root(name), []).append(name)
+        return [group for group in groups.values() if len(group) > 1]
+
+
+ALIAS_TAG = 'alias:'
+
+
+def skill_key(name: str, description: str) -> str:
+    """Exact lookup key of a skill, its normalised name and description together."""
+    return ' | '.join(re.sub(r'[^a-z0-9]+', ' ', (text or '').lower()).strip() for text in (name, description))
+
+
+def aliases(skill: Skill) -> List[str]:
+    """Lookup keys of the variants merged into the skill."""
+    return [tag[len(ALIAS_TAG):] for tag in skill.tags or [] if tag.startswith(ALIAS_TAG)]
+
+
+def add_alias(skill: Skill, key: str) -> bool:
+    if key == skill_key(skill.name, skill.description) or key in aliases(skill):
+        return False
+    skill.tags = list(skill.tags or []) + [ALIAS_TAG + key]
+    return True
+
+
+def best_variant(skills: List[Skill]) -> Skill:
+    """Most successful variant, the fastest one among equally successful variants."""
+    return max(skills, key=lambda skill: (skill.success_count, -skill.average_execution_time, -skill.failure_count))
+
+
+def merge_skills(keeper: Skill, duplicates: List[Skill]):
+    """
+    Folds the counters and tags of the duplicates into the keeper.
+    The lookup keys of a duplicate only become aliases when its code is the same as the keeper's, a near-duplicate
+    is found again by the similarity search instead of being run in place of its own code.
+    """
+    successes = keeper.success_count + sum(skill.success_count for skill in duplicates)
+    if successes:
+        keeper.average_execution_time = sum(skill.average_execution_time * skill.success_count
+                                            for skill in [keeper, *duplicates]) / successes
+    keeper.success_count = successes
+    keeper.failure_count += sum(skill.failure_count for skill in duplicates)
+
+    tags = list(keeper.tags or [])
+    for skill in duplicates:
+        tags.extend(tag for tag in skill.tags or [] if tag not in tags and not tag.startswith(ALIAS_TAG))
+    keeper.tags = tags or None
+    for skill in duplicates:
+        if same_code(skill.code, keeper.code):
+            for key in [skill_key(skill.name, skill.description), *aliases(skill)]:
+                add_alias(keeper, key)
+
+
+def rewrite_dependencies(skills: List[Skill], renames: Dict[str, str]) -> List[Skill]:
+    """Points the function_dependencies of the skills at the kept variants, returns the skills that changed."""
+    changed = []
+    for skill in skills:
+        dependencies = list(dict.fromkeys(renames.get(name, name) for name in skill.function_dependencies or []))
+        dependencies = [name for name in dependencies if name != skill.name]
+        if dependencies != list(skill.function_dependencies or []):
+            skill.function_dependencies = dependencies
+            changed.append(skill)
+    return changed
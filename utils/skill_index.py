@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class SkillIndex:
+    """
+    In-process cosine similarity index over skill embeddings
+        1. Embeddings are L2-normalised rows of one contiguous float32 matrix
+        2. Queries are answered in batches with a single matrix product and argpartition
+        3. Past ann_threshold rows, random-hyperplane LSH narrows the candidates before the exact scoring
+        4. Saved as <prefix>.npy + <prefix>.json and memory-mapped on load
+    """
+
+    def __init__(self, ann_threshold: int = 20000, n_tables: int = 8, n_planes: int = 12, seed: int = 0):
+        self.logger = logging.getLogger(__name__)
+        self.ann_threshold = ann_threshold
+        self.n_tables = n_tables
+        self.n_planes = n_planes
+        self.seed = seed
+        self.names: List[str] = []
+        self._data: Optional[np.ndarray] = None
+        self._size = 0
+        self._planes: Optional[np.ndarray] = None
+        self._buckets: Optional[List[dict]] = None
+        self._rows: Optional[dict] = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._data is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._data[:self._size]
+
+    @staticmethod
+    def _normalise(vectors) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def add(self, names: List[str], vectors):
+        vectors = self._normalise(vectors)
+        if len(names) != len(vectors):
+            raise ValueError(f"Got {len(names)} names for {len(vectors)} vectors")
+
+        if self._data is None:
+            self._data = np.empty((max(len(vectors), 64), vectors.shape[1]), dtype=np.float32)
+        elif self._data.shape[1] != vectors.shape[1]:
+            raise ValueError(f"Expected vectors of dimension {self._data.shape[1]}, got {vectors.shape[1]}")
+
+        required = self._size + len(vectors)
+        if required > len(self._data) or not self._data.flags.writeable:
+            data = np.empty((max(required, 2 * len(self._data)), self._data.shape[1]), dtype=np.float32)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+        self._data[self._size:required] = vectors
+        self._size = required
+        self.names.extend(names)
+        self._buckets = None
+        self._rows = None
+
+    def get(self, name: str) -> Optional[np.ndarray]:
+        """Normalised embedding of a name, the last one added when a name was added twice."""
+        if self._rows is None:
+            self._rows = {name: row for row, name in enumerate(self.names)}
+        row = self._rows.get(name)
+        return None if row is None else self.matrix[row]
+
+    def subset(self, names: List[str]) -> 'SkillIndex':
+        """New index holding only the given names, in their order, e.g. after skills were merged."""
+        index = SkillIndex(ann_threshold=self.ann_threshold, n_tables=self.n_tables, n_planes=self.n_planes,
+                           seed=self.seed)
+        vectors = [(name, self.get(name)) for name in names]
+        vectors = [(name, vector) for name, vector in vectors if vector is not None]
+        if vectors:
+            index.add([name for name, _ in vectors], np.stack([vector for _, vector in vectors]))
+        return index
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        """One integer bucket code per table and vector, shape (n_tables, n)."""
+        bits = np.einsum('tpd,nd->tnp', self._planes, vectors) > 0
+        return bits.dot(1 << np.arange(self.n_planes))
+
+    def _build_buckets(self):
+        rng = np.random.default_rng(self.seed)
+        self._planes = rng.standard_normal((self.n_tables, self.n_planes, self.matrix.shape[1])).astype(np.float32)
+        self._buckets = []
+        for codes in self._codes(self.matrix):
+            buckets = {}
+            for row, code in enumerate(codes):
+                buckets.setdefault(int(code), []).append(row)
+            self._buckets.append(buckets)
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        rows = set()
+        for table, code in enumerate(self._codes(query[None, :])[:, 0]):
+            rows.update(self._buckets[table].get(int(code), ()))
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+    def search(self, queries, k: int = 5) -> List[List[Tuple[str, float]]]:
+        """Returns the k best (name, cosine score) pairs for every query vector."""
+        if not self._size:
+            return [[] for _ in np.atleast_2d(queries)]
+
+        queries = self._normalise(queries)
+        k = min(k, self._size)
+
+        if self._size < self.ann_threshold:
+            scores = queries @ self.matrix.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = []
+            for query_scores, rows in zip(scores, top):
+                rows = rows[np.argsort(-query_scores[rows])]
+                results.append([(self.names[row], float(query_scores[row])) for row in rows])
+            return results
+
+        if self._buckets is None:
+            self._build_buckets()
+
+        results = []
+        for query in queries:
+            rows = self._candidates(query)
+            if len(rows) < k:
+                rows = np.arange(self._size)
+            scores = self.matrix[rows] @ query
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            results.append([(self.names[rows[i]], float(scores[i])) for i in best])
+        return results
+
+    def save(self, prefix: str):
+        np.save(f"{prefix}.npy", np.ascontiguousarray(self.matrix))
+        with open(f"{prefix}.json", 'w') as f:
+            json.dump({'names': self.names}, f)
+
+    @classmethod
+    def load(cls, prefix: str, **kwargs) -> Optional['SkillIndex']:
+        if not (os.path.exists(f"{prefix}.npy") and os.path.exists(f"{prefix}.json")):
+            return None
+
+        index = cls(**kwargs)
+        with open(f"{prefix}.json", 'r') as f:
+            index.names = json.load(f)['names']
+        index._data = np.load(f"{prefix}.npy", mmap_mode='r')
+        index._size = len(index._data)
+
+        if index._size != len(index.names):
+            index.logger.warning(f"Skill index {prefix} is inconsistent, ignoring it")
+            return None
+        return index
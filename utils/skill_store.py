@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from utils.model import Skill
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS skills (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    package_dependencies TEXT NOT NULL DEFAULT '[]',
+    function_dependencies TEXT NOT NULL DEFAULT '[]',
+    created_at TEXT,
+    success_count INTEGER NOT NULL DEFAULT 0,
+    failure_count INTEGER NOT NULL DEFAULT 0,
+    average_execution_time REAL NOT NULL DEFAULT 0.0,
+    tags TEXT
+);
+CREATE TABLE IF NOT EXISTS skill_code (
+    skill_id INTEGER PRIMARY KEY REFERENCES skills(id),
+    code TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS skills_name ON skills(name);
+"""
+
+_METADATA_COLUMNS = ('id, name, description, package_dependencies, function_dependencies, created_at, '
+                     'success_count, failure_count, average_execution_time, tags')
+
+
+class StoredSkill(Skill):
+    """A Skill whose code body stays in the SkillStore until it is first read."""
+
+    def __init__(self, store: 'SkillStore', skill_id: int, **fields):
+        self._store = store
+        self._code = None
+        self.skill_id = skill_id
+        super().__init__(code=None, **fields)
+
+    @property
+    def code(self) -> str:
+        if self._code is None and self._store is not None:
+            self._code = self._store.load_code(self.skill_id)
+        return self._code
+
+    @code.setter
+    def code(self, value: Optional[str]):
+        self._code = value
+
+
+class SkillStore:
+    """
+    SQLite backed skill storage
+        1. Metadata and code live in separate tables, load() only reads the metadata
+        2. Code bodies are fetched by id the first time StoredSkill.code is read
+        3. New skills are inserted, counters and code are updated in place, nothing is rewritten as a whole
+    """
+
+    def __init__(self, path: str):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM skills').fetchone()[0]
+
+    def _skill(self, row) -> StoredSkill:
+        (skill_id, name, description, package_dependencies, function_dependencies, created_at,
+         success_count, failure_count, average_execution_time, tags) = row
+        return StoredSkill(self, skill_id,
+                           name=name,
+                           description=description,
+                           package_dependencies=json.loads(package_dependencies),
+                           function_dependencies=json.loads(function_dependencies),
+                           created_at=datetime.fromisoformat(created_at) if created_at else None,
+                           success_count=success_count,
+                           failure_count=failure_count,
+                           average_execution_time=average_execution_time,
+                           tags=json.loads(tags) if tags else None)
+
+    def load(self) -> List[StoredSkill]:
+        with self._lock:
+            rows = self._connection.execute(f'SELECT {_METADATA_COLUMNS} FROM skills ORDER BY id').fetchall()
+        return [self._skill(row) for row in rows]
+
+    def load_code(self, skill_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute('SELECT code FROM skill_code WHERE skill_id = ?', (skill_id,)).fetchone()
+        return row[0] if row else None
+
+    def _insert(self, skill: Skill) -> int:
+        created_at = skill.created_at.isoformat() if isinstance(skill.created_at, datetime) else skill.created_at
+        cursor = self._connection.execute(
+            'INSERT INTO skills (name, description, package_dependencies, function_dependencies, created_at, '
+            'success_count, failure_count, average_execution_time, tags) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (skill.name, skill.description, json.dumps(skill.package_dependencies or []),
+             json.dumps(skill.function_dependencies or []), created_at, skill.success_count,
+             skill.failure_count, skill.average_execution_time,
+             json.dumps(skill.tags) if skill.tags is not None else None))
+        self._connection.execute('INSERT INTO skill_code (skill_id, code) VALUES (?, ?)',
+                                 (cursor.lastrowid, skill.code))
+        return cursor.lastrowid
+
+    def append(self, skill: Skill) -> StoredSkill:
+        with self._lock, self._connection:
+            skill_id = self._insert(skill)
+        stored = StoredSkill(self, skill_id,
+                             name=skill.name,
+                             description=skill.description,
+                             package_dependencies=skill.package_dependencies,
+                             function_dependencies=skill.function_dependencies,
+                             created_at=skill.created_at,
+                             success_count=skill.success_count,
+                             failure_count=skill.failure_count,
+                             average_execution_time=skill.average_execution_time,
+                             tags=skill.tags)
+        stored.code = skill.code
+        return stored
+
+    def extend(self, skills: Iterable[Skill]) -> int:
+        """Bulk insert in a single transaction, e.g. when importing a JSON skill library."""
+        count = 0
+        with self._lock, self._connection:
+            for skill in skills:
+                self._insert(skill)
+                count += 1
+        return count
+
+    def update_code(self, skill: StoredSkill):
+        with self._lock, self._connection:
+            self._connection.execute('UPDATE skill_code SET code = ? WHERE skill_id = ?', (skill.code, skill.skill_id))
+            self._connection.execute('UPDATE skills SET package_dependencies = ? WHERE id = ?',
+                                     (json.dumps(skill.package_dependencies or []), skill.skill_id))
+
+    def update_counters(self, skill: StoredSkill):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE skills SET success_count = ?, failure_count = ?, average_execution_time = ? WHERE id = ?',
+                (skill.success_count, skill.failure_count, skill.average_execution_time, skill.skill_id))
+
+    def update_metadata(self, skills: Iterable[StoredSkill]):
+        """Writes the counters, tags and function dependencies of the skills in one transaction."""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'UPDATE skills SET success_count = ?, failure_count = ?, average_execution_time = ?, tags = ?, '
+                'function_dependencies = ? WHERE id = ?',
+                [(skill.success_count, skill.failure_count, skill.average_execution_time,
+                  json.dumps(skill.tags) if skill.tags is not None else None,
+                  json.dumps(skill.function_dependencies or []), skill.skill_id) for skill in skills])
+
+    def delete(self, skills: Iterable[StoredSkill]) -> int:
+        ids = [(skill.skill_id,) for skill in skills]
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM skill_code WHERE skill_id = ?', ids)
+            self._connection.executemany('DELETE FROM skills WHERE id = ?', ids)
+        return len(ids)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,180 @@
+import json
+import re
+from typing import Any, Callable, List, Optional
+
+_NUMBER = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$')
+_LITERALS = ('true', 'false', 'null')
+_WHITESPACE = ' \t\n\r'
+
+
+class MalformedResponseError(ValueError):
+    pass
+
+
+class IncrementalJSONValidator:
+    """
+    Validates a streamed JSON completion one chunk at a time
+        1. Raises MalformedResponseError as soon as the text can no longer be valid JSON
+        2. Checks that the top-level object has expected_key with a value of the expected_type, keys before it are
+           validated like any JSON and skipped, the object closing without expected_key is malformed
+        3. Marks the response complete once the value of expected_key is closed, so the stream can be cut early
+        4. Calls on_item with every finished element when expected_type is 'array'
+    """
+
+    def __init__(self, expected_key: str, expected_type: str = 'string', max_chars: int = 64000,
+                 on_item: Optional[Callable[[Any], None]] = None):
+        self.expected_key = expected_key
+        self.expected_type = expected_type
+        self.max_chars = max_chars
+        self.on_item = on_item
+        self.buffer: List[str] = []
+        self.length = 0
+        self.complete = False
+        self.value: Any = None
+
+        self._stack: List[str] = []
+        self._expect = 'value'
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._literal = ''
+        self._top_key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+
+    def _fail(self, reason: str):
+        raise MalformedResponseError(f"{reason} at character {self.length}: {''.join(self.buffer[-80:])!r}")
+
+    def _text(self, start: int, end: int) -> str:
+        return ''.join(self.buffer[start:end])
+
+    def feed(self, chunk: str):
+        for char in chunk:
+            self.buffer.append(char)
+            self._step(char)
+            self.length += 1
+            if self.complete:
+                return
+        if self.length > self.max_chars:
+            self._fail(f"Response exceeded {self.max_chars} characters")
+
+    def _step(self, char: str):
+        position = self.length
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                self._end_string(position)
+            elif char in '\n\r':
+                self._fail("Unescaped newline in string")
+            return
+
+        if self._literal:
+            if char.isalnum() or char in '.+-':
+                self._literal += char
+                return
+            self._end_literal(position)
+
+        if char in _WHITESPACE:
+            return
+
+        if self._expect == 'done':
+            self._fail("Unexpected content after the JSON value")
+
+        if self._expect in ('value', 'value_or_end'):
+            if char == ']' and self._expect == 'value_or_end':
+                self._close(']', position)
+            elif char in '{[':
+                self._start_value(position, 'object' if char == '{' else 'array')
+                self._stack.append(char)
+                self._expect = 'key_or_end' if char == '{' else 'value_or_end'
+            elif char == '"':
+                self._start_value(position, 'string')
+                self._in_string = True
+                self._string_start = position
+            elif char.isalnum() or char == '-':
+                self._start_value(position, 'literal')
+                self._literal = char
+            else:
+                self._fail(f"Unexpected {char!r} where a value was expected")
+        elif self._expect in ('key', 'key_or_end'):
+            if char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char == '}' and self._expect == 'key_or_end':
+                self._close('}', position)
+            else:
+                self._fail(f"Unexpected {char!r} where a key was expected")
+        elif self._expect == 'colon':
+            if char != ':':
+                self._fail(f"Expected ':' but got {char!r}")
+            self._expect = 'value'
+        elif self._expect == 'comma_or_end':
+            if char == ',':
+                self._expect = 'key' if self._stack[-1] == '{' else 'value'
+            elif char in '}]':
+                self._close(char, position)
+            else:
+                self._fail(f"Expected ',' or a closing bracket but got {char!r}")
+
+    def _start_value(self, position: int, kind: str):
+        depth = len(self._stack)
+        if depth == 0 and kind != 'object':
+            self._fail("The response is not a JSON object")
+        if depth == 1 and self._top_key == self.expected_key:
+            if kind != self.expected_type:
+                self._fail(f"Expected {self.expected_key!r} to be a {self.expected_type}, got a {kind}")
+            self._value_start = position
+        if depth == 2 and self._value_start is not None and self._stack[-1] == '[':
+            self._item_start = position
+
+    def _end_string(self, position: int):
+        text = self._text(self._string_start, position + 1)
+        if self._expect in ('key', 'key_or_end'):
+            if len(self._stack) == 1:
+                self._top_key = json.loads(text)
+            self._expect = 'colon'
+        else:
+            self._end_value(position)
+
+    def _end_literal(self, position: int):
+        literal, self._literal = self._literal, ''
+        if literal not in _LITERALS and not _NUMBER.match(literal):
+            self._fail(f"Invalid literal {literal!r}")
+        self._end_value(position - 1)
+
+    def _close(self, char: str, position: int):
+        opening = self._stack.pop()
+        if (opening, char) not in (('{', '}'), ('[', ']')):
+            self._fail(f"Mismatched {char!r}")
+        self._end_value(position)
+
+    def _end_value(self, position: int):
+        depth = len(self._stack)
+        self._expect = 'comma_or_end' if depth else 'done'
+
+        if depth == 2 and self._item_start is not None and self.on_item is not None:
+            self.on_item(json.loads(self._text(self._item_start, position + 1)))
+            self._item_start = None
+
+        if depth == 1 and self._value_start is not None and self._top_key == self.expected_key:
+            self.value = json.loads(self._text(self._value_start, position + 1))
+            self.complete = True
+
+        if depth == 0 and not self.complete:
+            self._fail(f"The response has no {self.expected_key!r} key")
+
+    def finish(self):
+        """Called when the stream ends, a response that never closed the expected value is malformed."""
+        if not self.complete:
+            self._fail(f"The response ended before {self.expected_key!r} was complete")
+
+    def content(self) -> str:
+        """The completion as a parseable JSON document, even if the stream was cut after the value."""
+        if self.complete:
+            return json.dumps({self.expected_key: self.value})
+        return ''.join(self.buffer)
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.prompts import common_prefix_length, serialize_messages
+
+"""
+A local stand-in for the Ollama chat API, used to exercise the agent loop without a model or GPU.
+The reply is picked from the system prompt, so the planner, executor and reflection all receive
+a well-formed scripted response.
+"""
+
+
+def reply_kind(messages) -> str:
+    system_prompt = next((m.get('content', '') for m in messages if m.get('role') == 'system'), '')
+
+    if 'curriculum' in system_prompt:
+        return 'plan'
+    if 'coding assistant' in system_prompt:
+        return 'code'
+    return 'reflection'
+
+
+def scripted_reply(messages, plan_size: int = 2) -> str:
+    kind = reply_kind(messages)
+
+    if kind == 'plan':
+        tasks = [
+            {"id": 1, "name": "find_length_of_string", "description": "Calculate length of a string",
+             "dependencies": []},
+            {"id": 2, "name": "format_greeting", "description": "Format a greeting message for Alice",
+             "dependencies": []},
+        ]
+        tasks.extend({"id": i, "name": f"task_{i}", "description": f"Scripted task number {i}",
+                      "dependencies": [i - 1] if i % 3 == 0 else []} for i in range(3, plan_size + 1))
+        return json.dumps({"Tasks": tasks[:plan_size]})
+
+    if kind == 'code':
+        user_prompt = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+        match = re.search(r'The current task: (\w+)', user_prompt)
+        name = match.group(1) if match else 'solution'
+        return json.dumps({"code": f'def {name}():\n    """Scripted solution of {name}."""\n    return 42\n\n'
+                                   f'if __name__ == "__main__":\n    print({name}())\n'})
+
+    return json.dumps({"task": "stub", "reflection": "The stub server has no reflection to give."})
+
+
+def embed_text(text: str, dimensions: int = 64):
+    """Hashed bag-of-words embedding, texts sharing words get similar vectors."""
+    vector = [0.0] * dimensions
+    for word in re.findall(r'\w+', text.lower()):
+        digest = hashlib.md5(word.encode()).digest()
+        vector[digest[0] % dimensions] += 1.0 if digest[1] % 2 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class StubChatHandler(BaseHTTPRequestHandler):
+    server: 'StubChatServer'
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path not in ('/api/chat', '/api/embed'):
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path == '/api/embed':
+            texts = request.get('input') or []
+            texts = [texts] if isinstance(texts, str) else texts
+            self.server.record('embed', sum(len(text) for text in texts) // 4)
+            self._send_json(200, {"model": request.get('model', ''), "embeddings": [embed_text(t) for t in texts]})
+            return
+
+        messages = request.get('messages') or []
+        kind = reply_kind(messages)
+        prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4
+        self.server.record(kind, prompt_tokens)
+        evaluated = self.server.evaluate_prompt(request.get('model', ''), messages)
+
+        time.sleep(self.server.latency + evaluated * self.server.prompt_rate)
+
+        if self.server.inject('error_rate'):
+            self._send_json(500, {"error": "injected server failure"})
+            return
+
+        if kind == 'code' and self.server.inject('bad_code_rate'):
+            content = json.dumps({"code": "raise RuntimeError('injected failure')"})
+        else:
+            content = self.server.reply(messages)
+
+        payload = {
+            "model": request.get('model', ''),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(evaluated * self.server.prompt_rate * 1e9),
+            "eval_count": len(content) // 4,
+        }
+
+        if not request.get('stream', True):
+            if self.server.token_rate:
+                time.sleep(len(content) / self.server.chunk_size / self.server.token_rate)
+            self._send_json(200, payload)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        try:
+            for start in range(0, len(content), self.server.chunk_size):
+                chunk = {"model": payload["model"], "created_at": payload["created_at"],
+                         "message": {"role": "assistant", "content": content[start:start + self.server.chunk_size]},
+                         "done": False}
+                self.wfile.write(json.dumps(chunk).encode() + b'\n')
+                self.wfile.flush()
+                if self.server.token_rate:
+                    time.sleep(1 / self.server.token_rate)
+
+            payload["message"]["content"] = ""
+            self.wfile.write(json.dumps(payload).encode() + b'\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.logger.debug("Client closed the stream early")
+
+
+class StubChatServer(ThreadingHTTPServer):
+    """
+    Minimal /api/chat and /api/embed server running on a background thread
+        1. latency: seconds slept before every reply
+        2. token_rate: streamed chunks per second, 0 streams as fast as possible
+        3. error_rate: fraction of requests answered with HTTP 500
+        4. bad_code_rate: fraction of code replies replaced by code that raises
+        5. reply: callable mapping the request messages to the assistant content
+        6. prompt_rate: seconds of prompt processing per prompt token, the prefix shared with one of the last
+           cache_slots prompts of the model is served from a prompt cache and costs nothing
+    Every request is recorded as (kind, prompt_tokens) in self.requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, token_rate: float = 0.0,
+                 chunk_size: int = 4, error_rate: float = 0.0, bad_code_rate: float = 0.0, seed: int = 0,
+                 reply=scripted_reply, prompt_rate: float = 0.0, cache_slots: int = 4):
+        super().__init__((host, port), StubChatHandler)
+        self.logger = logging.getLogger(__name__)
+        self.latency = latency
+        self.token_rate = token_rate
+        self.chunk_size = chunk_size
+        self.error_rate = error_rate
+        self.bad_code_rate = bad_code_rate
+        self.reply = reply
+        self.prompt_rate = prompt_rate
+        self.cache_slots = cache_slots
+        self.requests = []
+        self._prompts = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, kind: str, prompt_tokens: int):
+        with self._lock:
+            self.requests.append((kind, prompt_tokens))
+
+    def evaluate_prompt(self, model: str, messages) -> int:
+        """Prompt tokens not covered by the cached prefixes of the model, the prompt is cached in turn."""
+        prompt = serialize_messages(messages)
+        with self._lock:
+            recent = self._prompts.setdefault(model, [])
+            cached = max((common_prefix_length(prompt, previous) for previous in recent), default=0)
+            recent.append(prompt)
+            del recent[:-self.cache_slots]
+        return (len(prompt) - cached) // 4
+
+    def inject(self, rate_name: str) -> bool:
+        with self._lock:
+            return self._random.random() < getattr(self, rate_name)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'StubChatServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        self.logger.info(f"Stub chat server listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    server = StubChatServer(port=11435)
+    server.serve_forever()
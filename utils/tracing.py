@@ -0,0 +1,120 @@
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+_span_ids = itertools.count(1)
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start: float
+    end: Optional[float] = None
+    span_id: int = field(default_factory=lambda: next(_span_ids))
+    parent_id: Optional[int] = None
+    thread_id: int = field(default_factory=threading.get_ident)
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """
+    Collects nested timing spans across threads and asyncio tasks
+        1. span() is a context manager, the enclosing span becomes the parent through a context variable
+        2. export_jsonl writes one span per line, export_chrome_trace writes a chrome://tracing / Perfetto file
+        3. summary() reports count and total / mean duration per span name from running totals, so it stays
+           cheap in a long-lived server
+        4. Finished spans are only kept for the exports while keep_spans is set, e.g. by main.py --trace
+    """
+
+    def __init__(self, enabled: bool = True, keep_spans: bool = True):
+        self.logger = logging.getLogger(__name__)
+        self.enabled = enabled
+        self.keep_spans = keep_spans
+        self.spans: List[Span] = []
+        self._totals: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._wall_origin = time.time()
+
+    @contextmanager
+    def span(self, name: str, category: str = 'agent', **attributes):
+        parent = _current_span.get()
+        span = Span(name=name, category=category, start=time.perf_counter(),
+                    parent_id=parent.span_id if parent else None, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            if self.enabled:
+                with self._lock:
+                    totals = self._totals.setdefault(name, [0, 0.0])
+                    totals[0] += 1
+                    totals[1] += span.end - span.start
+                    if self.keep_spans:
+                        self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self._totals.clear()
+
+    def _records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            spans = list(self.spans)
+        return [{'name': span.name,
+                 'category': span.category,
+                 'span_id': span.span_id,
+                 'parent_id': span.parent_id,
+                 'thread_id': span.thread_id,
+                 'start': self._wall_origin + span.start - self._origin,
+                 'duration': span.duration,
+                 'attributes': span.attributes} for span in sorted(spans, key=lambda span: span.start)]
+
+    def export_jsonl(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            for record in self._records():
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def export_chrome_trace(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        events = [{'name': record['name'],
+                   'cat': record['category'],
+                   'ph': 'X',
+                   'ts': (record['start'] - self._wall_origin) * 1e6,
+                   'dur': record['duration'] * 1e6,
+                   'pid': os.getpid(),
+                   'tid': record['thread_id'],
+                   'args': record['attributes']} for record in self._records()]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            totals = {name: tuple(values) for name, values in self._totals.items()}
+        return {name: {'count': count, 'total': total, 'mean': total / count}
+                for name, (count, total) in totals.items()}
+
+
+tracer = Tracer()
@@ -0,0 +1,227 @@
+import ast
+import builtins
+import importlib.util
+import json
+import re
+import sys
+import textwrap
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterable, List, Optional, Set, Tuple
+
+_FENCE = re.compile(r'```[ \t]*(?:python3?|py|json)?[ \t]*\n(.*?)(?:\n[ \t]*```|\Z)', re.DOTALL | re.IGNORECASE)
+_IMPLICIT_NAMES = {'__name__', '__file__', '__doc__', '__builtins__', '__spec__', '__loader__', '__package__',
+                   '__annotations__', '__dict__', '__class__', '__module__', '__qualname__'}
+
+
+@dataclass
+class ValidationResult:
+    code: str
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def error(self) -> Optional[str]:
+        return '\n'.join(self.errors) if self.errors else None
+
+
+def _parses(code: str) -> bool:
+    try:
+        ast.parse(textwrap.dedent(code))
+        return True
+    except (SyntaxError, ValueError):
+        return False
+
+
+def _unescape(code: str) -> str:
+    try:
+        return json.loads(f'"{code}"')
+    except ValueError:
+        return code.replace('\\n', '\n').replace('\\t', '\t')
+
+
+def clean_code(code: str) -> str:
+    """
+    Fixes the common formatting mistakes of generated code
+        1. Markdown code fences, keeping the first fenced block
+        2. A leftover {"code": "..."} JSON wrapper
+        3. Code sent with literal \\n escapes instead of newlines, only when it does not parse as it is and does
+           once unescaped, so escapes inside string literals like print('a\\nb') are kept
+        4. Windows line endings and a common indentation of every line
+    """
+    code = code.replace('\r\n', '\n').strip('\n')
+
+    match = _FENCE.search(code)
+    if match:
+        code = match.group(1)
+
+    stripped = code.strip()
+    if stripped.startswith('{') and stripped.endswith('}'):
+        try:
+            wrapped = json.loads(stripped)
+        except ValueError:
+            wrapped = None
+        if isinstance(wrapped, dict) and isinstance(wrapped.get('code'), str):
+            code = wrapped['code']
+
+    if '\\n' in code and not _parses(code):
+        unescaped = _unescape(code)
+        if _parses(unescaped):
+            code = unescaped
+
+    return textwrap.dedent(code).strip('\n') + '\n'
+
+
+@lru_cache(maxsize=1024)
+def module_available(name: str) -> bool:
+    if name in sys.builtin_module_names or name in sys.modules:
+        return True
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _guarded_imports(tree: ast.AST) -> Set[int]:
+    """Imports inside a try block that handles ImportError, they are allowed to be missing."""
+    guarded = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Try):
+            continue
+        handled = set()
+        for handler in node.handlers:
+            types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+            handled.update(getattr(exception, 'id', None) for exception in types)
+        if handled & {None, 'ImportError', 'ModuleNotFoundError', 'Exception', 'BaseException'}:
+            guarded.update(id(child) for statement in node.body for child in ast.walk(statement))
+    return guarded
+
+
+def missing_imports(tree: ast.AST, known_modules: Iterable[str] = ()) -> List[str]:
+    missing = []
+    known_modules = set(known_modules)
+    guarded = _guarded_imports(tree)
+    for node in ast.walk(tree):
+        if id(node) in guarded:
+            continue
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            root = name.split('.')[0]
+            if root not in known_modules and not module_available(root) and root not in missing:
+                missing.append(root)
+    return missing
+
+
+class _NameCollector(ast.NodeVisitor):
+    """Collects every name bound anywhere in the module and every name read, ignoring scopes."""
+
+    def __init__(self):
+        self.bound: Set[str] = set()
+        self.loaded = {}
+        self.star_import = False
+
+    def visit_Name(self, node: ast.Name):
+        if isinstance(node.ctx, ast.Load):
+            self.loaded.setdefault(node.id, node.lineno)
+        else:
+            self.bound.add(node.id)
+
+    def _bind_arguments(self, arguments: ast.arguments):
+        for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs:
+            self.bound.add(arg.arg)
+        for arg in (arguments.vararg, arguments.kwarg):
+            if arg is not None:
+                self.bound.add(arg.arg)
+
+    def _bind_function(self, node):
+        self.bound.add(node.name)
+        self._bind_arguments(node.args)
+        self.generic_visit(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = _bind_function
+
+    def visit_Lambda(self, node: ast.Lambda):
+        self._bind_arguments(node.args)
+        self.generic_visit(node)
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self.bound.add(node.name)
+        self.generic_visit(node)
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            self.bound.add(alias.asname or alias.name.split('.')[0])
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        for alias in node.names:
+            if alias.name == '*':
+                self.star_import = True
+            self.bound.add(alias.asname or alias.name)
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler):
+        if node.name:
+            self.bound.add(node.name)
+        self.generic_visit(node)
+
+    def visit_Global(self, node):
+        self.bound.update(node.names)
+
+    visit_Nonlocal = visit_Global
+
+    def visit_MatchAs(self, node):
+        if node.name:
+            self.bound.add(node.name)
+        self.generic_visit(node)
+
+    def visit_MatchStar(self, node):
+        if node.name:
+            self.bound.add(node.name)
+
+    def visit_MatchMapping(self, node):
+        if node.rest:
+            self.bound.add(node.rest)
+        self.generic_visit(node)
+
+
+def undefined_names(tree: ast.AST, known_names: Iterable[str] = ()) -> List[Tuple[str, int]]:
+    """
+    Names that are read but never bound anywhere in the code and are not builtins or known_names.
+    Scopes are ignored, so a name is only reported when no binding of it exists at all.
+    """
+    collector = _NameCollector()
+    collector.visit(tree)
+    if collector.star_import:
+        return []
+
+    known = collector.bound | set(dir(builtins)) | _IMPLICIT_NAMES | set(known_names)
+    return [(name, line) for name, line in collector.loaded.items() if name not in known]
+
+
+def validate_code(code: Optional[str], known_names: Iterable[str] = (),
+                  known_modules: Iterable[str] = ()) -> ValidationResult:
+    """
+    Cleans generated code and reports the problems that would make it fail before doing any work.
+    known_names / known_modules are provided by the execution environment, e.g. an ExecutionSession.
+    """
+    if not code or not code.strip():
+        return ValidationResult(code=code or '', errors=["ValueError: No code was generated"])
+
+    code = clean_code(code)
+    try:
+        tree = ast.parse(code, '<generated>')
+    except SyntaxError as e:
+        return ValidationResult(code=code, errors=[f"{type(e).__name__}: {e.msg} (line {e.lineno}): "
+                                                   f"{(e.text or '').strip()}"])
+
+    errors = [f"ModuleNotFoundError: No module named '{name}'" for name in missing_imports(tree, known_modules)]
+    errors.extend(f"NameError: name '{name}' is not defined (line {line})"
+                  for name, line in undefined_names(tree, known_names))
+    return ValidationResult(code=code, errors=errors)
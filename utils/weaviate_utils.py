@@ -1,25 +1,102 @@
 import weaviate
 import os
-from typing import List, Dict, Tuple
-from model import Skill
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Iterable
+from utils.model import Skill
+from utils.skill_dedup import SkillDeduplicator, same_code
 from weaviate.classes.config import Configure, Property, DataType
 
 
 class VectorDatabase:
-    def __init__(self, weaviate_host=None, weaviate_port=None, weaviate_grpc_host=None, weaviate_grpc_port=None):
+    """
+    Skill store on Weaviate
+        1. Holds one long-lived client, health-checked every health_check_interval seconds and reconnected on failure
+        2. insert_many streams skills through the batch interface
+        3. search_many serves several task descriptions in one call over the shared client
+        4. With a deduplicator, a skill whose normalised code is the same as a stored one is not inserted again.
+           The deduplicator is seeded from the Skills collection on first use. No embedding of the skill is at hand,
+           so a near-duplicate whose code differs, e.g. in its strings, is still inserted
+    """
+
+    def __init__(self, weaviate_host=None, weaviate_port=None, weaviate_grpc_host=None, weaviate_grpc_port=None,
+                 secure: bool = False, health_check_interval: float = 30.0, max_connect_attempts: int = 3,
+                 deduplicator: SkillDeduplicator = None):
         self.skill_id = 0
         self.weaviate_host = weaviate_host
         self.weaviate_port = weaviate_port
         self.weaviate_grpc_host = weaviate_grpc_host
         self.weaviate_grpc_port = weaviate_grpc_port
+        self.secure = secure
+        self.health_check_interval = health_check_interval
+        self.max_connect_attempts = max_connect_attempts
+        self.logger = logging.getLogger(__name__)
+        self.deduplicator = deduplicator
+        self._uuids: Dict[str, object] = {}
+        self._codes: Dict[str, str] = {}
+        self._dedup_seeded = False
+        self._client = None
+        self._last_health_check = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        for attempt in range(1, self.max_connect_attempts + 1):
+            try:
+                return weaviate.connect_to_custom(http_host=self.weaviate_host,
+                                                  http_port=self.weaviate_port,
+                                                  http_secure=self.secure,
+                                                  grpc_host=self.weaviate_grpc_host,
+                                                  grpc_port=self.weaviate_grpc_port,
+                                                  grpc_secure=self.secure)
+            except Exception as e:
+                if attempt == self.max_connect_attempts:
+                    raise
+                self.logger.warning(f"Connecting to Weaviate failed (attempt {attempt}): {e}")
+                time.sleep(0.5 * 2 ** (attempt - 1))
+
+    @property
+    def client(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._client is not None and now - self._last_health_check > self.health_check_interval:
+                try:
+                    healthy = self._client.is_ready()
+                except Exception:
+                    healthy = False
+                self._last_health_check = now
+
+                if not healthy:
+                    self.logger.warning("Weaviate connection is unhealthy, reconnecting")
+                    self._close_client()
+
+            if self._client is None:
+                self._client = self._connect()
+                self._last_health_check = now
+
+            return self._client
+
+    def _close_client(self):
+        try:
+            self._client.close()
+        except Exception:
+            pass
+        self._client = None
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._close_client()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def initialize_skill_library(self):
-        client = weaviate.connect_to_custom(http_host=self.weaviate_host,
-                                            http_port=self.weaviate_port,
-                                            http_secure=True,
-                                            grpc_host=self.weaviate_grpc_host,
-                                            grpc_port=self.weaviate_grpc_port,
-                                            grpc_secure=True)
+        client = self.client
 
         if not client.collections.exists("Skills"):
             """
@@ -56,15 +133,8 @@ class VectorDatabase:
         else:
             print("Skills object exists")
 
-        client.close()
-
-    def insert(self, skill: Skill):
-        client = weaviate.connect_to_custom(http_host=self.weaviate_host, http_port=self.weaviate_port,
-                                            http_secure=False,
-                                            grpc_host=self.weaviate_grpc_host, grpc_port=self.weaviate_grpc_port,
-                                            grpc_secure=False)
-        SkillObject = client.collections.get("Skills")
-        uuid = SkillObject.data.insert({
+    def _properties(self, skill: Skill) -> Dict:
+        properties = {
             "skill_id": self.skill_id,
             "name": skill.name,
             "description": skill.description,
@@ -76,13 +146,67 @@ class VectorDatabase:
             "failure_count": skill.failure_count,
             "average_execution_time": skill.average_execution_time,
             "tags": skill.tags
-        })
-        print("Skill inserted with uuid: ", uuid)
+        }
         self.skill_id += 1
+        return properties
+
+    def _register(self, name: str, code: str, uuid=None):
+        self.deduplicator.add(name, code)
+        self._codes[name] = code
+        if uuid is not None:
+            self._uuids[name] = uuid
+
+    def _seed_deduplicator(self):
+        """Signs the code of the skills already in the Skills collection, once."""
+        if self._dedup_seeded:
+            return
+        if self.client.collections.exists("Skills"):
+            for item in self.client.collections.get("Skills").iterator(return_properties=["name", "code"]):
+                if item.properties.get("name") and item.properties.get("code"):
+                    self._register(item.properties["name"], item.properties["code"], item.uuid)
+        self._dedup_seeded = True
+        self.logger.info(f"Near-duplicate index seeded with {len(self.deduplicator)} stored skills")
+
+    def _duplicate_of(self, skill: Skill):
+        """Name of a stored skill with the same normalised code, the skill is registered when there is none."""
+        if self.deduplicator is None:
+            return None
+        self._seed_deduplicator()
+        match = self.deduplicator.find(skill.code)
+        if match is not None and same_code(skill.code, self._codes.get(match[0])):
+            self.logger.info(f"Skill {skill.name} duplicates {match[0]} (similarity {match[1]:.2f}), not inserted")
+            return match[0]
+        self._register(skill.name, skill.code)
+        return None
+
+    def insert(self, skill: Skill):
+        duplicate = self._duplicate_of(skill)
+        if duplicate is not None:
+            return self._uuids.get(duplicate)
+
+        SkillObject = self.client.collections.get("Skills")
+        uuid = SkillObject.data.insert(self._properties(skill))
+        self._uuids[skill.name] = uuid
+        print("Skill inserted with uuid: ", uuid)
+        return uuid
+
+    def insert_many(self, skills: Iterable[Skill], batch_size: int = 200) -> int:
+        """Streams the skills through Weaviate's batch interface, returns the number of objects that failed."""
+        SkillObject = self.client.collections.get("Skills")
+
+        with SkillObject.batch.fixed_size(batch_size=batch_size) as batch:
+            for skill in skills:
+                if self._duplicate_of(skill) is None:
+                    batch.add_object(properties=self._properties(skill))
+
+        failed = SkillObject.batch.failed_objects
+        for failure in failed[:10]:
+            self.logger.error(f"Skill insert failed: {failure.message}")
+        self.logger.info(f"Batch insert finished, {len(failed)} failed objects")
+        return len(failed)
 
     def search(self, msg, distance: int = 0.3):
-        client = weaviate.connect_to_local(host=self.weaviate_host, port=self.weaviate_port)
-        Question = client.collections.get("Skills")
+        Question = self.client.collections.get("Skills")
         response = Question.query.near_text(
             query=msg,
             distance=distance
@@ -92,6 +216,17 @@ class VectorDatabase:
         print(ids)
         return list(map(int, ids))
 
+    def search_many(self, msgs: List[str], distance: int = 0.3, max_workers: int = 8) -> List[List[int]]:
+        """Runs the near_text queries concurrently on the shared client, results follow the order of msgs."""
+        Question = self.client.collections.get("Skills")
+
+        def search_one(msg):
+            response = Question.query.near_text(query=msg, distance=distance)
+            return [int(o.properties["skill_id"]) for o in response.objects]
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, max(len(msgs), 1))) as pool:
+            return list(pool.map(search_one, msgs))
+
 
 if __name__ == "__main__":
     client = weaviate.connect_to_local(